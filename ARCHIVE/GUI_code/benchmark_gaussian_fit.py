@@ -0,0 +1,543 @@
+# autopep8: off
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numba
+import numpy as np
+import scipy
+
+from gaussian_fitting import (
+    _get_grids,
+    estimate_gaussian_widths,
+    fit_2D_gaussian,
+    fit_2D_gaussian_marginals,
+    gaussian_initial_guess_stack,
+    model_and_jac,
+    peak_pos_2D,
+    rotated_2D_gaussian,
+)
+
+# autopep8: on
+
+# usage (from this folder):
+#   python benchmark_gaussian_fit.py --output results.json                 run the suite and save it
+#   python benchmark_gaussian_fit.py --compare results.json                run it again and flag regressions
+#   python benchmark_gaussian_fit.py --fit-kwargs '{"solver": "lm"}'       benchmark other fit_2D_gaussian settings
+#   python benchmark_gaussian_fit.py --compare-solvers --compare-dtypes    side by side solver/dtype tables
+#   python benchmark_gaussian_fit.py --check-uncertainties                 std errors against noise resampling
+#   python benchmark_gaussian_fit.py --compare-subsampling                 speed/accuracy of pixel subsampling
+#   python benchmark_gaussian_fit.py --compare-peak                        robust/sub-pixel peak finder against argmax
+#   python benchmark_gaussian_fit.py --compare-marginals                   1D marginal fit against the 2D fit
+#   python benchmark_gaussian_fit.py --compare-stack-guess                 batched initial guesses against a frame loop
+#   python benchmark_gaussian_fit.py --startup                             import/warmup/first fit latency
+#   python benchmark_gaussian_fit.py --import-time                         -X importtime of the modules
+
+PARAM_NAMES = ("A", "x0", "y0", "Dx", "Dy", "phi", "offset")
+
+
+def make_gaussian_frame(h, w, params, noise=0.0, seed=0):
+    """returns a h x w frame of rotated_2D_gaussian(*params) (A, x0, y0, Dx, Dy, phi, offset) with gaussian noise of std noise"""
+    x, y = _get_grids(h, w)
+    frame = rotated_2D_gaussian(x, y, *[float(p) for p in params])
+    if noise > 0:
+        frame = frame + np.random.default_rng(seed).normal(0.0, noise, frame.shape)
+    return frame
+
+
+def canonical_params(params):
+    """returns gaussian parameters with Dx >= Dy and phi in [-pi/2, pi/2) since (Dx, Dy, phi) and (Dy, Dx, phi+pi/2) describe the same beam"""
+    A, x0, y0, Dx, Dy, phi, offset = params[:7]
+    if Dx < Dy:
+        Dx, Dy, phi = Dy, Dx, phi + np.pi / 2
+    phi = (phi + np.pi / 2) % np.pi - np.pi / 2
+    return np.array([A, x0, y0, Dx, Dy, phi, offset])
+
+
+def case_params(size, beam_fraction=0.2, ellipticity=1.5, amplitude=1000.0, offset=50.0, phi=0.4):
+    """ground truth (A, x0, y0, Dx, Dy, phi, offset) of a size x size benchmark frame with a major 1/e² diameter of
+    beam_fraction*size and a minor diameter smaller by ellipticity"""
+    D_major = beam_fraction * size
+    return (amplitude, 0.45 * size, 0.55 * size, D_major, D_major / ellipticity, phi, offset)
+
+
+def random_beam_params(size, seed, offset=50.0):
+    """random ground truth (A, x0, y0, Dx, Dy, phi, offset) of a size x size frame: a beam of 10-40% of size, up to
+    3 times elliptical, rotated by any angle and placed anywhere in the middle 30% of the frame"""
+    rng = np.random.default_rng(seed)
+    D_major = rng.uniform(0.1, 0.4) * size
+    x0, y0 = rng.uniform(0.35, 0.65, 2) * size
+    return (rng.uniform(300, 2000), x0, y0, D_major, D_major / rng.uniform(1.1, 3.0), rng.uniform(-np.pi / 2, np.pi / 2), offset)
+
+
+def default_cases(sizes=(64, 256, 1024, 4096)):
+    """returns the benchmark cases as dicts (name, size, noise, ellipticity, beam_fraction). Starting from a 256 px,
+    1% noise, 1.5 ellipticity, 20% beam base case one property at a time is varied"""
+    base = {"size": 256, "noise": 0.01, "ellipticity": 1.5, "beam_fraction": 0.2}
+    variations = [("size", v) for v in sizes]
+    variations += [("noise", v) for v in (0.0, 0.05, 0.2)]
+    variations += [("ellipticity", v) for v in (1.0, 3.0)]
+    variations += [("beam_fraction", v) for v in (0.03, 0.5)]
+    cases = []
+    for key, value in variations:
+        case = {**base, key: value}
+        case["name"] = " ".join(f"{k}={case[k]}" for k in base)
+        if case["name"] not in [c["name"] for c in cases]:
+            cases.append(case)
+    return cases
+
+
+def percentile_ms(times, q):
+    return float(1e3 * np.percentile(times, q))
+
+
+def benchmark_case(case, repeats=10, fit_kwargs=None):
+    """fits repeats noisy frames of a case and returns fits per second, p50/p99 latency, mean nfev, failures and the
+    median absolute error per parameter against the ground truth. Large frames use fewer repeats (at least 3)"""
+    fit_kwargs = fit_kwargs or {}
+    size = case["size"]
+    truth = case_params(size, case["beam_fraction"], case["ellipticity"])
+    repeats = max(3, min(repeats, int(repeats * 512**2 / size**2)))
+    fit_2D_gaussian(make_gaussian_frame(size, size, truth), **fit_kwargs)  # compile/load numba kernels and fill the grid cache
+
+    times, nfevs, errors, failures = [], [], [], 0
+    for seed in range(repeats):
+        frame = make_gaussian_frame(size, size, truth, noise=case["noise"] * truth[0], seed=seed)
+        start_time = time.perf_counter()
+        result, info = fit_2D_gaussian(frame, return_info=True, **fit_kwargs)
+        times.append(time.perf_counter() - start_time)
+        nfevs.append(info["nfev"])
+        if result is None:
+            failures += 1
+        else:
+            errors.append(np.abs(canonical_params(result) - canonical_params(truth)))
+
+    median_errors = np.median(errors, axis=0) if errors else np.full(7, np.nan)
+    if case["ellipticity"] == 1.0:
+        median_errors[5] = np.nan  # phi is undefined for round beams
+    return {
+        **case,
+        "repeats": repeats,
+        "fits_per_s": float(repeats / np.sum(times)),
+        "p50_ms": percentile_ms(times, 50),
+        "p99_ms": percentile_ms(times, 99),
+        "mean_nfev": float(np.mean(nfevs)),
+        "failures": failures,
+        "median_abs_error": dict(zip(PARAM_NAMES, (float(e) for e in median_errors))),
+    }
+
+
+def benchmark_kernels(sizes=(64, 256, 1024, 4096), repeats=5):
+    """returns the median time of model_and_jac, rotated_2D_gaussian and estimate_gaussian_widths per frame size"""
+    results = []
+    for size in sizes:
+        truth = case_params(size)
+        frame = make_gaussian_frame(size, size, truth)
+        x, y = _get_grids(size, size)
+        kernels = {
+            "model_and_jac": lambda: model_and_jac(x, y, *truth),
+            "rotated_2D_gaussian": lambda: rotated_2D_gaussian(x, y, *truth),
+            "estimate_gaussian_widths": lambda: estimate_gaussian_widths(frame),
+        }
+        for name, kernel in kernels.items():
+            kernel()
+            times = []
+            for _ in range(repeats):
+                start_time = time.perf_counter()
+                kernel()
+                times.append(time.perf_counter() - start_time)
+            results.append({"kernel": name, "size": size, "p50_ms": percentile_ms(times, 50)})
+    return results
+
+
+def run_suite(sizes=(64, 256, 1024, 4096), repeats=10, fit_kwargs=None, verbose=True):
+    """runs all cases and kernel timings and returns them as a JSON serializable dict"""
+    results = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform": platform.platform(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "numba": numba.__version__,
+            "fit_kwargs": fit_kwargs or {},
+        },
+        "cases": [],
+        "kernels": benchmark_kernels(sizes),
+    }
+    if verbose:
+        print(f"{'case':<60} {'fits/s':>8} {'p50 [ms]':>9} {'p99 [ms]':>9} {'nfev':>6} {'fail':>4} {'err x0':>8} {'err Dx':>8}")
+    for case in default_cases(sizes):
+        result = benchmark_case(case, repeats, fit_kwargs)
+        results["cases"].append(result)
+        if verbose:
+            errors = result["median_abs_error"]
+            print(
+                f"{case['name']:<60} {result['fits_per_s']:>8.2f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['mean_nfev']:>6.1f} {result['failures']:>4} {errors['x0']:>8.4f} {errors['Dx']:>8.4f}"
+            )
+    return results
+
+
+def compare_results(current, baseline, tolerance=1.25):
+    """prints the p50 latency ratio and error change of every case present in both result dicts and returns the names
+    of regressed cases: slower than tolerance times the baseline, more failures or a parameter error that grew by
+    more than tolerance (plus 1e-3 to ignore noise on near exact fits)"""
+    if current["meta"]["fit_kwargs"] != baseline["meta"]["fit_kwargs"]:
+        print(f"note: fit_kwargs differ ({current['meta']['fit_kwargs']} vs baseline {baseline['meta']['fit_kwargs']})")
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    print(f"{'case':<60} {'p50 ratio':>10} {'worst error ratio':>18}")
+    for case in current["cases"]:
+        old = baseline_cases.get(case["name"])
+        if old is None:
+            continue
+        latency_ratio = case["p50_ms"] / old["p50_ms"]
+        error_ratios = [
+            (case["median_abs_error"][name] + 1e-3) / (old["median_abs_error"][name] + 1e-3)
+            for name in PARAM_NAMES
+            if not (np.isnan(case["median_abs_error"][name]) or np.isnan(old["median_abs_error"][name]))
+        ]
+        worst_error_ratio = max(error_ratios, default=1.0)
+        regressed = latency_ratio > tolerance or worst_error_ratio > tolerance or case["failures"] > old["failures"]
+        if regressed:
+            regressions.append(case["name"])
+        print(f"{case['name']:<60} {latency_ratio:>10.2f} {worst_error_ratio:>18.2f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def time_fit(frame, repeats, **fit_kwargs):
+    """returns (median seconds, result, info, peak traced memory in bytes) of fit_2D_gaussian(frame, **fit_kwargs)"""
+    fit_2D_gaussian(frame, **fit_kwargs)  # compile/load numba kernels and fill the grid cache
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result, info = fit_2D_gaussian(frame, return_info=True, **fit_kwargs)
+        times.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    fit_2D_gaussian(frame, **fit_kwargs)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return float(np.median(times)), result, info, peak_memory
+
+
+def compare_solvers(
+    sizes=(64, 128, 256, 512, 1024), solvers=("trf", "lm"), noise=10.0, repeats=5, n_random=80, random_size=128, pyramid_bins=(None, 4)
+):
+    """prints time, nfev, peak memory and largest parameter error of every solver of fit_2D_gaussian per frame size,
+    then the wrong fits (failed or rms residual above 1.15 times noise) of every solver and pyramid_bin on n_random
+    random_beam_params beams, which catches fits stuck in a local minimum such as a wrong rotation"""
+    print(f"{'size':>6} {'solver':>6} {'time [ms]':>10} {'nfev':>5} {'memory [MB]':>12} {'max |error|':>12}")
+    for size in sizes:
+        truth = case_params(size)
+        frame = make_gaussian_frame(size, size, truth, noise=noise)
+        for solver in solvers:
+            seconds, result, info, peak_memory = time_fit(frame, repeats, solver=solver)
+            error = np.nan if result is None else np.max(np.abs(canonical_params(result) - canonical_params(truth)))
+            print(f"{size:>6} {solver:>6} {1e3 * seconds:>10.2f} {info['nfev']:>5} {peak_memory / 1e6:>12.2f} {error:>12.4f}")
+
+    print(f"\n{n_random} random rotated elliptical beams, {random_size} px, noise {noise}")
+    print(f"{'solver':>6} {'pyramid':>7} {'wrong':>6} {'median rms/noise':>17} {'max rms/noise':>14}")
+    truths = [random_beam_params(random_size, seed) for seed in range(n_random)]
+    frames = [make_gaussian_frame(random_size, random_size, truth, noise, seed) for seed, truth in enumerate(truths)]
+    for solver in solvers:
+        for pyramid_bin in pyramid_bins:
+            results = [fit_2D_gaussian(frame, solver=solver, pyramid_bin=pyramid_bin) for frame in frames]
+            rms = np.array([np.inf if result is None else result[7] for result in results]) / noise
+            print(f"{solver:>6} {str(pyramid_bin):>7} {np.sum(rms > 1.15):>6} {np.median(rms):>17.3f} {np.max(rms):>14.3f}")
+
+
+def compare_dtypes(sizes=(256, 512, 1024), solvers=("trf", "lm"), noise=10.0, repeats=5):
+    """prints time and the largest parameter difference to the float64 fit of the float32 fit with and without float64 polish"""
+    variants = {
+        "float64": dict(dtype=np.float64),
+        "float32": dict(dtype=np.float32),
+        "f32+polish": dict(dtype=np.float32, float64_polish=True),
+    }
+    print(f"{'size':>6} {'solver':>6} {'dtype':>11} {'time [ms]':>10} {'speedup':>8} {'max |delta|':>12}")
+    for size in sizes:
+        frame = make_gaussian_frame(size, size, case_params(size), noise=noise)
+        for solver in solvers:
+            reference_seconds, reference = None, None
+            for name, kwargs in variants.items():
+                seconds, result, _, _ = time_fit(frame, repeats, solver=solver, **kwargs)
+                if reference is None:
+                    reference_seconds, reference = seconds, result
+                if result is None or reference is None:
+                    delta = np.nan
+                else:
+                    delta = np.max(np.abs(canonical_params(result) - canonical_params(reference)))
+                print(f"{size:>6} {solver:>6} {name:>11} {1e3 * seconds:>10.2f} {reference_seconds / seconds:>8.2f} {delta:>12.2e}")
+
+
+def compare_peak_finders(sizes=(256, 1024, 2048), noise=10.0, hot_pixel=5.0, repeats=20, small_diameters=(4, 6, 8), small_size=2048, n_small=20):
+    """prints time and position error of peak_pos_2D with robust=False (argmax) and robust=True on float64 and uint16
+    frames, without and with a single hot pixel of hot_pixel times the beam amplitude in a corner. Then for beams of
+    small_diameters pixels at random positions in n_small small_size frames how often the peak is more than 3 px off and
+    how often fit_2D_gaussian(roi="auto") misses the beam by more than 1 px (small beams on large sensors)"""
+    print(f"{'size':>6} {'dtype':>8} {'hot px':>6} {'robust':>6} {'time [ms]':>10} {'|error| [px]':>13}")
+    for size in sizes:
+        truth = case_params(size, beam_fraction=0.1)
+        clean = make_gaussian_frame(size, size, truth, noise=noise)
+        for dtype in (np.float64, np.uint16):
+            for hot in (False, True):
+                frame = np.clip(clean, 0, 65535).astype(dtype)
+                if hot:
+                    frame[3, 5] = hot_pixel * truth[0]
+                for robust in (False, True):
+                    peak_pos_2D(frame, robust=robust)  # compile/load the numba block sums
+                    start_time = time.perf_counter()
+                    for _ in range(repeats):
+                        row, col = peak_pos_2D(frame, robust=robust)
+                    seconds = (time.perf_counter() - start_time) / repeats
+                    error = np.hypot(row - truth[2], col - truth[1])
+                    print(f"{size:>6} {np.dtype(dtype).name:>8} {str(hot):>6} {str(robust):>6} {1e3 * seconds:>10.3f} {error:>13.3f}")
+
+    print(f"\n{'size':>6} {'D [px]':>7} {'argmax misses':>14} {'robust misses':>14} {'roi auto misses':>16}")
+    for D in small_diameters:
+        misses = np.zeros(3, dtype=int)
+        for seed in range(n_small):
+            rng = np.random.default_rng(seed)
+            x0, y0 = rng.uniform(0.05, 0.95, 2) * small_size
+            truth = (1000.0, x0, y0, float(D), D / 1.4, 0.3, 50.0)
+            frame = make_gaussian_frame(small_size, small_size, truth, noise=noise, seed=seed)
+            for k, robust in enumerate((False, True)):
+                row, col = peak_pos_2D(frame, robust=robust)
+                misses[k] += np.hypot(row - y0, col - x0) > 3
+            result = fit_2D_gaussian(frame, roi="auto", solver="lm")
+            misses[2] += result is None or np.hypot(result[1] - x0, result[2] - y0) > 1
+        print(f"{small_size:>6} {D:>7} {misses[0]:>14} {misses[1]:>14} {misses[2]:>16}")
+
+
+def compare_marginal_fit(sizes=(256, 1024, 2048), noise=10.0, repeats=20):
+    """prints frames per second and the largest x0, y0, Dx, Dy error of fit_2D_gaussian_marginals (cold and warm
+    started from the previous result) next to the 2D lm fit on unrotated uint16 frames"""
+    print(f"{'size':>6} {'method':>16} {'frames/s':>10} {'max |error| x0,y0,Dx,Dy':>26}")
+    for size in sizes:
+        truth = list(case_params(size))
+        truth[5] = 0.0  # the marginal fit has no angle
+        frame = np.clip(make_gaussian_frame(size, size, truth, noise=noise), 0, 65535).astype(np.uint16)
+        last = fit_2D_gaussian_marginals(frame)
+        methods = {
+            "marginals": lambda: fit_2D_gaussian_marginals(frame),
+            "marginals warm": lambda: fit_2D_gaussian_marginals(frame, initial_guess=last),
+            "2D lm": lambda: fit_2D_gaussian(frame, solver="lm"),
+        }
+        for name, fit in methods.items():
+            result = fit()
+            method_repeats = repeats if name != "2D lm" else max(3, repeats // 10)
+            start_time = time.perf_counter()
+            for _ in range(method_repeats):
+                fit()
+            seconds = (time.perf_counter() - start_time) / method_repeats
+            error = np.max(np.abs(np.array(result[1:5]) - truth[1:5]))
+            print(f"{size:>6} {name:>16} {1 / seconds:>10.1f} {error:>26.4f}")
+
+
+def compare_stack_guess(shapes=((2000, 256, 256), (200, 1024, 1024)), noise=10.0):
+    """prints the time per frame of gaussian_initial_guess_stack against peak_pos_2D and estimate_gaussian_widths in
+    a loop over the frames of uint16 stacks with moving beams"""
+    print(f"{'stack':>18} {'loop ms/frame':>14} {'batched ms/frame':>17} {'speedup':>8}")
+    for n_frames, h, w in shapes:
+        rng = np.random.default_rng(0)
+        frames = np.empty((n_frames, h, w), dtype=np.uint16)
+        for i in range(n_frames):
+            params = list(case_params(min(h, w)))
+            params[1:3] = rng.uniform(0.3, 0.7) * w, rng.uniform(0.3, 0.7) * h
+            frames[i] = np.clip(make_gaussian_frame(h, w, params, noise=noise, seed=i), 0, 65535)
+        gaussian_initial_guess_stack(frames[:2])  # compile/load the numba block sums
+        start_time = time.perf_counter()
+        for frame in frames:
+            peak_pos_2D(frame)
+            estimate_gaussian_widths(frame)
+            frame.min(), frame.max()
+        loop_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        gaussian_initial_guess_stack(frames)
+        batched_seconds = time.perf_counter() - start_time
+        stack = f"{n_frames}x{h}x{w}"
+        print(f"{stack:>18} {1e3 * loop_seconds / n_frames:>14.3f} {1e3 * batched_seconds / n_frames:>17.3f} {loop_seconds / batched_seconds:>8.1f}")
+
+
+def compare_subsampling(
+    sizes=(512, 2048), subsamples=(None, 2, 4, 8, 16, "auto"), solvers=("trf", "lm"), noise=10.0, repeats=5, noise_free_subsample=8
+):
+    """prints time, speedup and largest parameter error per subsample setting of fit_2D_gaussian, with and without
+    the full resolution refinement. A last row per solver fits a noise-free frame with noise_free_subsample, whose
+    error has to be about 0 (the bounds come from the full frame, not the samples, which can miss the peak)"""
+    print(
+        f"{'size':>6} {'solver':>6} {'noise':>6} {'subsample':>10} {'refine':>6} {'pixels':>9} {'time [ms]':>10} {'speedup':>8}"
+        f" {'max |error|':>12}"
+    )
+    for size in sizes:
+        truth = case_params(size)
+        frames = {noise: make_gaussian_frame(size, size, truth, noise=noise), 0.0: make_gaussian_frame(size, size, truth)}
+        for solver in solvers:
+            reference_seconds = None
+            refines = {subsample: (False, True) if subsample is not None else (False,) for subsample in subsamples}
+            settings = [(noise, subsample, refine) for subsample in subsamples for refine in refines[subsample]]
+            if noise_free_subsample is not None:
+                settings.append((0.0, noise_free_subsample, False))
+            for frame_noise, subsample, refine in settings:
+                frame = frames[frame_noise]
+                seconds, result, info, _ = time_fit(frame, repeats, solver=solver, subsample=subsample, subsample_refine=refine)
+                if reference_seconds is None:
+                    reference_seconds = seconds
+                rows, cols = info.get("subsample_shape", frame.shape)
+                error = np.nan if result is None else np.max(np.abs(canonical_params(result) - canonical_params(truth)))
+                print(
+                    f"{size:>6} {solver:>6} {frame_noise:>6g} {str(subsample):>10} {str(refine):>6} {rows * cols:>9}"
+                    f" {1e3 * seconds:>10.2f} {reference_seconds / seconds:>8.2f} {error:>12.4f}"
+                )
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import gaussian_fitting
+import_s = time.perf_counter() - start_time
+aot = gaussian_fitting.use_aot_kernels({aot})
+warmup_s = gaussian_fitting.warmup() if {warmup} else 0.0
+from benchmark_gaussian_fit import case_params, make_gaussian_frame
+frame = make_gaussian_frame(256, 256, case_params(256), noise=10.0)
+fit_s = []
+for _ in range(2):
+    start_time = time.perf_counter()
+    gaussian_fitting.fit_2D_gaussian(frame, solver="{solver}")
+    fit_s.append(time.perf_counter() - start_time)
+print(json.dumps(dict(aot=aot, import_s=import_s, warmup_s=warmup_s, first_fit_s=fit_s[0], second_fit_s=fit_s[1])))
+"""
+
+
+IMPORT_STATEMENTS = (
+    "import helper_functions",
+    "import helper_functions; helper_functions.is_list",
+    "import helper_functions; helper_functions.fit_2D_gaussian",
+    "import gaussian_fitting",
+)
+
+
+def measure_import_time(statements=IMPORT_STATEMENTS, repeats=3):
+    """prints the import time (python -X importtime, best of repeats fresh interpreters) of the first module of each
+    statement and which heavy dependencies the whole statement loaded"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    heavy = ("numpy", "numba", "scipy", "serial")
+    check = "; import sys; print(' '.join(m for m in " + repr(heavy) + " if m in sys.modules))"
+    print(f"{'statement':<58} {'import [ms]':>12}  heavy modules loaded")
+    for statement in statements:
+        module = statement.split(";")[0].split()[-1]
+        best_us = None
+        for _ in range(repeats):
+            command = [sys.executable, "-X", "importtime", "-c", statement + check]
+            output = subprocess.run(command, cwd=folder, capture_output=True, text=True, check=True)
+            # stderr lines are "import time: self [us] | cumulative | module", the top level module is the last one named so
+            cumulative_us = [int(line.split("|")[1]) for line in output.stderr.splitlines() if line.rstrip().endswith(f"| {module}")]
+            best_us = min(cumulative_us[-1], best_us or cumulative_us[-1])
+        print(f"{statement:<58} {best_us / 1e3:>12.1f}  {output.stdout.strip() or '-'}")
+
+
+def measure_startup(solvers=("trf", "lm")):
+    """prints import, warmup() and first/second fit latency of fresh interpreters in order: without and with warmup()
+    starting from an empty numba cache (the warmup fills it for all kernels), then both again with the filled cache
+    and finally with the ahead of time kernels (if built with build_aot_kernels)"""
+    variants = [("cold jit", False, False), ("cold warmup", False, True), ("cached jit", False, False), ("cached warmup", False, True)]
+    variants.append(("aot", True, False))
+    print(f"{'solver':>6} {'variant':>14} {'import [s]':>11} {'warmup [s]':>11} {'1st fit [ms]':>13} {'2nd fit [ms]':>13}")
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for solver in solvers:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+            for name, aot, warmup in variants:
+                script = STARTUP_SCRIPT.format(aot=aot, warmup=warmup, solver=solver)
+                output = subprocess.run([sys.executable, "-c", script], cwd=folder, env=env, capture_output=True, text=True, check=True)
+                result = json.loads(output.stdout.splitlines()[-1])
+                if aot and not result["aot"]:
+                    print(f"{solver:>6} {name:>14}  not built (see build_aot_kernels)")
+                    continue
+                print(
+                    f"{solver:>6} {name:>14} {result['import_s']:>11.2f} {result['warmup_s']:>11.2f}"
+                    f" {1e3 * result['first_fit_s']:>13.1f} {1e3 * result['second_fit_s']:>13.1f}"
+                )
+
+
+def check_uncertainties(size=64, noise=10.0, samples=200, solvers=("trf", "lm")):
+    """fits samples noise realisations of the same frame and prints per parameter the scatter of the fits next to the
+    median std error fit_2D_gaussian(uncertainties=True) reports. Returns the largest ratio deviation from 1"""
+    truth = case_params(size)
+    worst = 0.0
+    print(f"{'solver':>6} " + " ".join(f"{name:>21}" for name in PARAM_NAMES))
+    for solver in solvers:
+        fits, std_errors = [], []
+        for seed in range(samples):
+            frame = make_gaussian_frame(size, size, truth, noise=noise, seed=seed)
+            result, info = fit_2D_gaussian(frame, initial_guess=truth, solver=solver, uncertainties=True, return_info=True)
+            if result is not None and info["std_errors"] is not None:
+                fits.append(result[:7])
+                std_errors.append(info["std_errors"])
+        scatter = np.std(fits, axis=0, ddof=1)
+        reported = np.median(std_errors, axis=0)
+        worst = max(worst, float(np.max(np.abs(reported / scatter - 1))))
+        print(f"{solver:>6} " + " ".join(f"{s:>10.3g}/{r:<10.3g}" for s, r in zip(scatter, reported)))
+    print(f"(scatter of {samples} fits / reported std error, largest ratio deviation {worst:.2f})")
+    return worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark suite for fit_2D_gaussian and its kernels")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 1024, 4096], help="frame sizes of the size sweep")
+    parser.add_argument("--repeats", type=int, default=10, help="fits per case (reduced for large frames)")
+    parser.add_argument("--fit-kwargs", type=json.loads, default={}, help="JSON dict of fit_2D_gaussian keyword arguments")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown/error growth factor for --compare")
+    parser.add_argument("--compare-solvers", action="store_true", help="only print the solver comparison table")
+    parser.add_argument("--compare-dtypes", action="store_true", help="only print the float32/float64 comparison table")
+    parser.add_argument("--compare-subsampling", action="store_true", help="only print the pixel subsampling table")
+    parser.add_argument("--compare-peak", action="store_true", help="only print the peak finder comparison table")
+    parser.add_argument("--compare-marginals", action="store_true", help="only print the marginal fit comparison table")
+    parser.add_argument("--compare-stack-guess", action="store_true", help="only print the batched initial guess table")
+    parser.add_argument("--startup", action="store_true", help="only print the startup and first fit latency table")
+    parser.add_argument("--import-time", action="store_true", help="only print the import time of the modules")
+    parser.add_argument("--check-uncertainties", action="store_true", help="only compare the std errors with resampling")
+    args = parser.parse_args(argv)
+
+    tables = {
+        "compare_solvers": compare_solvers,
+        "compare_dtypes": compare_dtypes,
+        "compare_subsampling": compare_subsampling,
+        "compare_peak": compare_peak_finders,
+        "compare_marginals": compare_marginal_fit,
+        "compare_stack_guess": compare_stack_guess,
+        "startup": measure_startup,
+        "import_time": measure_import_time,
+    }
+    selected = [name for name in tables if getattr(args, name)]
+    if selected or args.check_uncertainties:
+        for name in selected:
+            tables[name]()
+        if args.check_uncertainties:
+            return int(check_uncertainties() > 0.3)
+        return 0
+
+    results = run_suite(tuple(args.sizes), args.repeats, args.fit_kwargs)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare_results(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
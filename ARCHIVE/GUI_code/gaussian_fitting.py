@@ -0,0 +1,1845 @@
+# autopep8: off
+
+import importlib
+import importlib.machinery
+import importlib.util
+import inspect
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numba
+import numpy as np
+from numba import njit, prange
+from scipy.optimize import least_squares
+
+if __package__:
+    from .helper_functions import run_as_thread
+else:
+    from helper_functions import run_as_thread
+
+# autopep8: on
+
+
+def peak_pos_2D(image, robust=True, bin_size="auto"):
+    """Returns the (row, column) (vertical from top, horizontal) position of the peak in a 2D image.
+    robust=False is the plain argmax of all pixels: integer positions and a single hot pixel wins.
+    Note: robust=True (the default) returns float sub-pixel positions, not the integer index tuple (np.unravel_index)
+    of earlier versions, so callers that index the image with it need robust=False (or to round). It searches the maximum of the bin_size x bin_size block sums first ("auto": about 64 blocks
+    across the smaller side, all pixels are summed so beams smaller than a block are found), then of the box filtered
+    full resolution pixels of the best block and its neighbours (box radius bin_size // 4) and refines it to sub-pixel
+    precision with a parabola through the maximum and the box filtered values one box radius away per axis. If the box
+    is wider than the beam (flat top) the box is reduced to the half width of the beam first.
+    All of it is one numba pass that reads every pixel once. Measured with --compare-peak of benchmark_gaussian_fit.py
+    (argmax in brackets): 1024² float64 0.54 ms (0.47), uint16 0.20 ms (0.11); 2048² float64 2.1 ms (1.9),
+    uint16 0.83 ms (0.46); 256² 0.04-0.05 ms (0.01-0.02)"""
+    image = np.asanyarray(image)
+    if not robust:
+        return np.unravel_index(np.argmax(image), image.shape)
+    row, col = peak_pos_2D_stack(image[np.newaxis], robust, bin_size)[0]
+    return float(row), float(col)
+
+
+@njit(cache=True)
+def _block_sums(image, bin_size, row_sums):
+    """returns the sums of the bin_size x bin_size blocks of image (incomplete blocks at the edges dropped). Every pixel
+    is read, so beams smaller than a block are not skipped. row_sums is a buffer of at least image.shape[1] elements
+    for the row sums of a block, of dtype _row_sums_dtype(image.dtype)"""
+    out = np.zeros((image.shape[0] // bin_size, image.shape[1] // bin_size))
+    n_cols = out.shape[1] * bin_size
+    for i in range(out.shape[0]):
+        row_sums[:n_cols] = 0
+        for k in range(bin_size):  # whole rows first (contiguous, vectorized), then the columns per block
+            row = image[i * bin_size + k]
+            for j in range(n_cols):
+                row_sums[j] += row[j]
+        for j in range(out.shape[1]):
+            total = 0.0
+            for m in range(bin_size):
+                total += row_sums[j * bin_size + m]
+            out[i, j] = total
+    return out
+
+
+def _row_sums_dtype(dtype):
+    """accumulator dtype of _block_sums: uint32 for 8 and 16 bit unsigned frames (exact up to 65536 rows and twice as
+    fast as converting every pixel to float), float64 otherwise"""
+    if np.dtype(dtype) in (np.uint8, np.uint16):
+        return np.uint32
+    return np.float64
+
+
+def _box_filter(image, r):
+    """returns the (2r+1) x (2r+1) box sum of every pixel of image (edges padded) from an integral image. image can also
+    be a stack (..., h, w), the filter runs over the last two axes"""
+    image = np.asarray(image, dtype=np.float64)
+    padded = np.pad(image, [(0, 0)] * (image.ndim - 2) + [(r, r), (r, r)], mode="edge")
+    integral = np.zeros((*padded.shape[:-2], padded.shape[-2] + 1, padded.shape[-1] + 1))
+    integral[..., 1:, 1:] = padded.cumsum(-2).cumsum(-1)
+    n = 2 * r + 1
+    return integral[..., n:, n:] - integral[..., :-n, n:] - integral[..., n:, :-n] + integral[..., :-n, :-n]
+
+
+@njit(cache=True)
+def _window_box_sums(window, r):
+    """returns the (2r+1) x (2r+1) box sum of every pixel of window (edges padded with the edge pixels, as _box_filter)
+    from an integral image"""
+    h, w = window.shape
+    n = 2 * r + 1
+    integral = np.zeros((h + n, w + n))
+    for i in range(h + n - 1):
+        source_row = min(max(i - r, 0), h - 1)
+        row_total = 0.0
+        for j in range(w + n - 1):
+            row_total += window[source_row, min(max(j - r, 0), w - 1)]
+            integral[i + 1, j + 1] = integral[i, j + 1] + row_total
+    out = np.empty((h, w))
+    for i in range(h):
+        for j in range(w):
+            out[i, j] = integral[i + n, j + n] - integral[i, j + n] - integral[i + n, j] + integral[i, j]
+    return out
+
+
+@njit(cache=True)
+def _parabola_offset(left, center, right, d):
+    """returns the offset (at most d/2) of the vertex of the parabola through (-d, left), (0, center), (d, right),
+    0 if it does not open downwards"""
+    curvature = left - 2 * center + right
+    if curvature >= 0:
+        return 0.0
+    return min(max(0.5 * d * (left - right) / curvature, -d / 2), d / 2)
+
+
+@njit(cache=True)
+def _beam_half_width(window, smooth, row, col, r):
+    """returns the half width at half maximum (rounded, between 1 and r) of the beam at row, col of window from the
+    area above half maximum of the 3x3 box mean within r pixels, with the darkest box mean of the (2r+1)² box sums
+    smooth as baseline"""
+    h, w = window.shape
+    baseline = smooth.min() / (2 * r + 1) ** 2
+    rows = range(max(row - r, 0), min(row + r + 1, h))
+    cols = range(max(col - r, 0), min(col + r + 1, w))
+    fine = np.zeros((len(rows), len(cols)))
+    for a, i in enumerate(rows):
+        for b, j in enumerate(cols):
+            total = 0.0
+            for di in range(-1, 2):
+                for dj in range(-1, 2):
+                    total += window[min(max(i + di, 0), h - 1), min(max(j + dj, 0), w - 1)]
+            fine[a, b] = total / 9
+    half_level = (baseline + fine.max()) / 2
+    area = np.count_nonzero(fine > half_level)
+    return min(max(int(np.rint(np.sqrt(area / np.pi))), 1), r)
+
+
+@njit(cache=True)
+def _refine_peak(window, r):
+    """sub-pixel (row, column) of the peak of window: maximum of the (2r+1)² box sums, with the box reduced to the beam
+    half width if it is wider than the beam (flat top), and parabola offsets through the box sums r pixels away"""
+    h, w = window.shape
+    smooth = _window_box_sums(window, r)
+    index = np.argmax(smooth)
+    row, col = index // w, index % w
+    if r > 1:
+        r_beam = _beam_half_width(window, smooth, row, col, r)
+        if r_beam < r:  # the box has a flat top over the beam: its maximum is anywhere within r - r_beam pixels
+            smooth = _window_box_sums(window, r_beam)
+            best, fine_row, fine_col = -np.inf, row, col
+            for i in range(max(row - r, 0), min(row + r + 1, h)):
+                for j in range(max(col - r, 0), min(col + r + 1, w)):
+                    if smooth[i, j] > best:
+                        best, fine_row, fine_col = smooth[i, j], i, j
+            row, col, r = fine_row, fine_col, r_beam
+    row_offset = col_offset = 0.0
+    if row - r >= 0 and row + r < h:
+        row_offset = _parabola_offset(smooth[row - r, col], smooth[row, col], smooth[row + r, col], r)
+    if col - r >= 0 and col + r < w:
+        col_offset = _parabola_offset(smooth[row, col - r], smooth[row, col], smooth[row, col + r], r)
+    return row + row_offset, col + col_offset
+
+
+@njit(cache=True)
+def _robust_peaks(frames, bin_size, row_sums):
+    """robust peak positions (n, 2) of a (n, h, w) stack of frames, see peak_pos_2D. The 3x3 block windows are shifted
+    inside the frame at the edges. row_sums is the _block_sums buffer"""
+    n, h, w = frames.shape
+    out = np.empty((n, 2))
+    r = max(1, bin_size // 4)
+    for k in range(n):
+        row_start = col_start = 0
+        window_h, window_w = h, w
+        if bin_size > 1:
+            window_h, window_w = min(h, 3 * bin_size), min(w, 3 * bin_size)
+            block_sums = _block_sums(frames[k], bin_size, row_sums)
+            index = np.argmax(block_sums)
+            block_row, block_col = index // block_sums.shape[1], index % block_sums.shape[1]
+            row_start = min(max((block_row - 1) * bin_size, 0), h - window_h)
+            col_start = min(max((block_col - 1) * bin_size, 0), w - window_w)
+        row, col = _refine_peak(frames[k, row_start : row_start + window_h, col_start : col_start + window_w], r)
+        out[k, 0] = row_start + row
+        out[k, 1] = col_start + col
+    return out
+
+
+def estimate_gaussian_widths(image):
+    """
+    Estimate the 1/e² diameter (mean of Dx and Dy) from second moments of the image.
+    Assumes image is already cropped to region of interest. Computed from the row and column sums (one pass, no pixel
+    grids, see estimate_gaussian_widths_stack).
+    """
+    row_sums, col_sums = _marginals(np.asarray(image))
+    return float(_second_moment_diameters(row_sums[np.newaxis], col_sums[np.newaxis])[0])
+
+
+# ----- batched peak and width estimation of frame stacks -----
+@njit(cache=True)
+def _marginals_stack(frames):
+    """_marginals of every frame of a (n_frames, h, w) stack: returns row sums (n_frames, h) and column sums (n_frames, w)"""
+    row_sums = np.empty((frames.shape[0], frames.shape[1]))
+    col_sums = np.empty((frames.shape[0], frames.shape[2]))
+    for n in range(frames.shape[0]):
+        row_sums[n], col_sums[n] = _marginals(frames[n])
+    return row_sums, col_sums
+
+
+def _second_moment_diameters(row_sums, col_sums):
+    """returns the mean 1/e² diameters 2*sqrt(2)*sigma of x and y of the rows of row_sums (n, h) and col_sums (n, w),
+    1.0 where the sum is not positive"""
+    total = row_sums.sum(axis=1)
+    safe_total = np.where(total > 0, total, 1.0)
+    sigmas = []
+    for sums in (row_sums, col_sums):
+        coords = np.arange(sums.shape[1], dtype=np.float64)
+        center = sums @ coords / safe_total
+        variance = sums @ coords**2 / safe_total - center**2
+        sigmas.append(np.sqrt(np.maximum(variance, 0)))
+    diameters = 2 * np.sqrt(2) * (sigmas[0] + sigmas[1]) / 2  # stddev to 1/e² diameter
+    return np.where(total > 0, diameters, 1.0)
+
+
+def estimate_gaussian_widths_stack(frames):
+    """estimate_gaussian_widths of every frame of a (n_frames, h, w) stack in one pass over the pixels (row and column
+    sums in one numba call) and vectorized moments: returns a (n_frames,) array of the mean 1/e² diameters"""
+    frames = np.asarray(frames)
+    if frames.ndim != 3:
+        raise ValueError(f"frames has to be 3D (n_frames, h, w), got shape {frames.shape}")
+    return _second_moment_diameters(*_marginals_stack(frames))
+
+
+def peak_pos_2D_stack(frames, robust=True, bin_size="auto"):
+    """peak_pos_2D of every frame of a (n_frames, h, w) stack without a python loop over the frames (one numba call).
+    Returns an (n_frames, 2) array of (row, column), integer for robust=False.
+    peak_pos_2D runs the same code on a single frame, so the positions are the same as per frame"""
+    frames = np.asarray(frames)
+    if frames.ndim != 3:
+        raise ValueError(f"frames has to be 3D (n_frames, h, w), got shape {frames.shape}")
+    n_frames, h, w = frames.shape
+    if not robust:
+        flat_index = np.argmax(frames.reshape(n_frames, -1), axis=1)
+        return np.stack(np.unravel_index(flat_index, (h, w)), axis=1)
+    if bin_size == "auto":
+        bin_size = max(1, min(h, w) // 64)
+    return _robust_peaks(frames, int(bin_size), np.empty(w, dtype=_row_sums_dtype(frames.dtype)))
+
+
+def gaussian_initial_guess_stack(frames):
+    """returns the default initial_guess of fit_2D_gaussian (A, x0, y0, D, D, phi=0, offset) of every frame of a
+    (n_frames, h, w) stack as (n_frames, 7) array, computed in one vectorized pass (see fit_2D_gaussian_stack)"""
+    frames = np.asarray(frames)
+    vmin = frames.min(axis=(1, 2)).astype(np.float64)
+    vmax = frames.max(axis=(1, 2)).astype(np.float64)
+    peaks = peak_pos_2D_stack(frames)
+    diameters = estimate_gaussian_widths_stack(frames)
+    zeros = np.zeros(len(frames))
+    return np.stack([vmax - vmin, peaks[:, 1], peaks[:, 0], diameters, diameters, zeros, vmin], axis=1)
+
+
+# ----- core model -----
+# x are the column (w,) and y the row (h,) coordinates, broadcast inside the loops so no dense h x w grids are needed.
+# Typed for float64 and float32 (compiled on first use or by warmup). Constants are cast to the coordinate dtype
+# (x.dtype.type) so float32 inputs are computed and returned in float32. The per row work is shared by the serial kernels and their _parallel variants
+# (rows split over numba threads with prange, see set_fit_threads)
+_gaussian_kernel_signatures = [
+    "(float64[::1], float64[::1], float64, float64, float64, float64, float64, float64, float64)",
+    "(float32[::1], float32[::1], float32, float32, float32, float32, float32, float32, float32)",
+]
+
+
+@njit(fastmath=True, cache=True)
+def _gaussian_row(x, y_shift, A, x0, invDx2, invDy2, c, s, offset, out_row):
+    f = x.dtype.type
+    for j in range(x.size):
+        x_shift = x[j] - x0
+        xp = c * x_shift + s * y_shift
+        yp = -s * x_shift + c * y_shift
+        out_row[j] = A * np.exp(f(-8.0) * (xp * xp * invDx2 + yp * yp * invDy2)) + offset
+
+
+@njit(fastmath=True, cache=True)
+def rotated_2D_gaussian(x, y, A, x0, y0, D_1_over_e2_x, D_1_over_e2_y, phi, offset):
+    f = x.dtype.type
+    invDx2 = f(1.0) / (D_1_over_e2_x * D_1_over_e2_x)
+    invDy2 = f(1.0) / (D_1_over_e2_y * D_1_over_e2_y)
+    out = np.empty((y.size, x.size), dtype=x.dtype)
+    for i in range(y.size):
+        _gaussian_row(x, y[i] - y0, A, x0, invDx2, invDy2, np.cos(phi), np.sin(phi), offset, out[i])
+    return out
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _rotated_2D_gaussian_parallel(x, y, A, x0, y0, D_1_over_e2_x, D_1_over_e2_y, phi, offset):
+    f = x.dtype.type
+    invDx2 = f(1.0) / (D_1_over_e2_x * D_1_over_e2_x)
+    invDy2 = f(1.0) / (D_1_over_e2_y * D_1_over_e2_y)
+    out = np.empty((y.size, x.size), dtype=x.dtype)
+    for i in prange(y.size):
+        _gaussian_row(x, y[i] - y0, A, x0, invDx2, invDy2, np.cos(phi), np.sin(phi), offset, out[i])
+    return out
+
+
+@njit(fastmath=True, cache=True)
+def _model_and_jac_row(x, y_shift, A, x0, Dx, Dy, phi, offset, start, m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi):
+    f = x.dtype.type
+    c = np.cos(phi)
+    s = np.sin(phi)
+    invDx2 = f(1.0) / (Dx * Dx)
+    invDy2 = f(1.0) / (Dy * Dy)
+    for j in range(x.size):
+        k = start + j
+        x_shift = x[j] - x0
+        xp = c * x_shift + s * y_shift
+        yp = -s * x_shift + c * y_shift
+        g = np.exp(f(-8.0) * (xp * xp * invDx2 + yp * yp * invDy2))
+        # derivatives of E = -8*(t^2+u^2) times A*g, with dxp/dphi = yp and dyp/dphi = -xp
+        Ag16 = f(16.0) * A * g
+        m[k] = A * g + offset
+        J_A[k] = g
+        J_x0[k] = Ag16 * (c * xp * invDx2 - s * yp * invDy2)
+        J_y0[k] = Ag16 * (s * xp * invDx2 + c * yp * invDy2)
+        J_Dx[k] = Ag16 * xp * xp * invDx2 / Dx
+        J_Dy[k] = Ag16 * yp * yp * invDy2 / Dy
+        J_phi[k] = -Ag16 * xp * yp * (invDx2 - invDy2)
+
+
+@njit(fastmath=True, cache=True)
+def model_and_jac(x, y, A, x0, y0, Dx, Dy, phi, offset):
+    """returns the raveled model and its derivatives for A, x0, y0, Dx, Dy, phi, offset"""
+    n = y.size * x.size
+    m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi = np.empty((7, n), dtype=x.dtype)
+    for i in range(y.size):
+        _model_and_jac_row(x, y[i] - y0, A, x0, Dx, Dy, phi, offset, i * x.size, m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi)
+    return m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi, np.ones(n, dtype=x.dtype)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _model_and_jac_parallel(x, y, A, x0, y0, Dx, Dy, phi, offset):
+    n = y.size * x.size
+    m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi = np.empty((7, n), dtype=x.dtype)
+    for i in prange(y.size):
+        _model_and_jac_row(x, y[i] - y0, A, x0, Dx, Dy, phi, offset, i * x.size, m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi)
+    return m, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi, np.ones(n, dtype=x.dtype)
+
+
+# ----- cached coordinate vectors (size bounded LRU) -----
+_grid_cache = OrderedDict()
+_grid_cache_lock = threading.Lock()
+_grid_cache_limits = {"max_entries": 256, "max_bytes": 64 * 2**20}
+_grid_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _get_grids(h, w, dtype=np.float64):
+    """returns the cached 1D coordinate vectors (x of length w, y of length h) of a h x w frame"""
+    key = (h, w, np.dtype(dtype))
+    with _grid_cache_lock:
+        g = _grid_cache.get(key)
+        if g is not None:
+            _grid_cache.move_to_end(key)
+            _grid_cache_stats["hits"] += 1
+            return g
+        _grid_cache_stats["misses"] += 1
+        x = np.arange(w, dtype=dtype)
+        y = np.arange(h, dtype=dtype)
+        _grid_cache[key] = (x, y)
+        _grid_cache_stats["bytes"] += x.nbytes + y.nbytes
+        _trim_grid_cache()
+        return x, y
+
+
+def _trim_grid_cache():
+    """evicts least recently used grids until the cache is within _grid_cache_limits (call with _grid_cache_lock held)"""
+    while len(_grid_cache) > 1 and (
+        len(_grid_cache) > _grid_cache_limits["max_entries"] or _grid_cache_stats["bytes"] > _grid_cache_limits["max_bytes"]
+    ):
+        _, (x, y) = _grid_cache.popitem(last=False)
+        _grid_cache_stats["bytes"] -= x.nbytes + y.nbytes
+        _grid_cache_stats["evictions"] += 1
+
+
+def set_grid_cache_limits(max_entries=None, max_bytes=None):
+    """sets the maximum number of frame shapes and bytes kept in the coordinate grid cache (None keeps the current value)"""
+    with _grid_cache_lock:
+        if max_entries is not None:
+            _grid_cache_limits["max_entries"] = max_entries
+        if max_bytes is not None:
+            _grid_cache_limits["max_bytes"] = max_bytes
+        _trim_grid_cache()
+
+
+def grid_cache_info():
+    """returns a dict with entries, bytes, hits, misses, evictions and the limits of the coordinate grid cache"""
+    with _grid_cache_lock:
+        return {"entries": len(_grid_cache), **_grid_cache_stats, **_grid_cache_limits}
+
+
+def clear_grid_cache():
+    """empties the coordinate grid cache and resets its statistics"""
+    with _grid_cache_lock:
+        _grid_cache.clear()
+        _grid_cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
+
+
+# ----- kernel threading -----
+_parallel_min_pixels = 256 * 256  # below this the serial kernels are faster than starting the numba threads
+
+
+def set_fit_threads(n_threads):
+    """Sets the number of numba threads used by the parallel gaussian kernels, clipped to 1..NUMBA_NUM_THREADS.
+    The threading layer itself is chosen by numba (NUMBA_THREADING_LAYER). Like numba.set_num_threads it applies to
+    the calling thread, so call it in the thread that runs the fits. Returns the number of threads set"""
+    n_threads = max(1, min(int(n_threads), numba.config.NUMBA_NUM_THREADS))
+    numba.set_num_threads(n_threads)
+    return n_threads
+
+
+def fit_threading_info():
+    """returns a dict with the numba threading layer (None before the first parallel kernel ran), the number of threads
+    of the calling thread and the maximum number of threads"""
+    try:
+        threading_layer = numba.threading_layer()
+    except ValueError:
+        threading_layer = None
+    return {
+        "threading_layer": threading_layer,
+        "num_threads": numba.get_num_threads(),
+        "max_threads": numba.config.NUMBA_NUM_THREADS,
+    }
+
+
+def _use_parallel_kernels(n_pixels, parallel):
+    """parallel="auto" uses the threaded kernels only for frames of at least _parallel_min_pixels and more than one thread"""
+    if parallel == "auto":
+        return n_pixels >= _parallel_min_pixels and numba.get_num_threads() > 1
+    return bool(parallel)
+
+
+# ----- fused numba Levenberg-Marquardt solver -----
+@njit(fastmath=True, cache=True)
+def _normal_equations_row(x, y_shift, image_row, p, acc):
+    """adds the J^T J lower triangle (acc[:28]), J^T r (acc[28:35]) and sum(r²) (acc[35]) of one image row to acc"""
+    f = image_row.dtype.type
+    A, x0, Dx, Dy, phi, offset = p[0], p[1], p[3], p[4], p[5], p[6]
+    c = np.cos(phi)
+    s = np.sin(phi)
+    invDx2 = f(1.0) / (Dx * Dx)
+    invDy2 = f(1.0) / (Dy * Dy)
+    J = np.empty(7)
+    J[6] = 1.0
+    for j in range(x.size):
+        x_shift = x[j] - x0
+        xp = c * x_shift + s * y_shift
+        yp = -s * x_shift + c * y_shift
+        g = np.exp(f(-8.0) * (xp * xp * invDx2 + yp * yp * invDy2))
+        Ag16 = f(16.0) * A * g
+        J[0] = g
+        J[1] = Ag16 * (c * xp * invDx2 - s * yp * invDy2)
+        J[2] = Ag16 * (s * xp * invDx2 + c * yp * invDy2)
+        J[3] = Ag16 * xp * xp * invDx2 / Dx
+        J[4] = Ag16 * yp * yp * invDy2 / Dy
+        J[5] = -Ag16 * xp * yp * (invDx2 - invDy2)
+        r = A * g + offset - image_row[j]
+        acc[35] += r * r
+        idx = 0
+        for a in range(7):
+            acc[28 + a] += J[a] * r
+            for b in range(a + 1):
+                acc[idx] += J[a] * J[b]
+                idx += 1
+
+
+@njit(cache=True)
+def _unpack_normal_equations(acc):
+    JtJ = np.empty((7, 7))
+    idx = 0
+    for a in range(7):
+        for b in range(a + 1):
+            JtJ[a, b] = acc[idx]
+            JtJ[b, a] = acc[idx]
+            idx += 1
+    return JtJ, acc[28:35].copy(), 0.5 * acc[35]
+
+
+@njit(fastmath=True, cache=True)
+def _gaussian_normal_equations(x, y, image, p):
+    """returns J^T J (7x7), J^T r (7) and the cost 0.5*sum(r²) of the rotated gaussian at parameters p in one pass over
+    the pixels without storing the model or the Jacobian. The per pixel math runs in the dtype of the inputs (p has to
+    match), the sums are accumulated in float64"""
+    acc = np.zeros(36)
+    for i in range(y.size):
+        _normal_equations_row(x, y[i] - p[2], image[i], p, acc)
+    return _unpack_normal_equations(acc)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _gaussian_normal_equations_parallel(x, y, image, p):
+    """_gaussian_normal_equations with the rows split over numba threads (one partial sum per row, then reduced)"""
+    partial = np.zeros((y.size, 36))
+    for i in prange(y.size):
+        _normal_equations_row(x, y[i] - p[2], image[i], p, partial[i])
+    return _unpack_normal_equations(partial.sum(axis=0))
+
+
+# termination status of a fit: 1..4 converged and 0, -1 as in scipy's least_squares, the negative ones below are
+# added by this module. info["failure"] of fit_2D_gaussian is the reason of a failed fit
+_status_flat_image = -4
+_status_deadline = -3
+_status_damping_limit = -2
+_fit_status_reasons = {
+    _status_flat_image: "flat image",
+    _status_deadline: "time budget exceeded",
+    _status_damping_limit: "no decrease of the cost",
+    -1: "improper input parameters",
+    0: "maximum number of function evaluations exceeded",
+    1: "gtol termination",
+    2: "ftol termination",
+    3: "xtol termination",
+    4: "ftol and xtol termination",
+}
+
+
+def _wrap_angle(phi):
+    """returns the rotation angle phi wrapped to [-pi/2, pi/2); a rotated gaussian is the same after rotating it by pi"""
+    return (phi + np.pi / 2) % np.pi - np.pi / 2
+
+
+def _solve_gaussian_lm(
+    x, y, image, p0, lb, ub, maxfev, ftol=1e-6, xtol=1e-6, gtol=1e-6, deadline=None, normal_equations=_gaussian_normal_equations
+):
+    """Levenberg-Marquardt with Marquardt (diagonal) scaling on the normal equations of _gaussian_normal_equations.
+    Steps are projected onto the bounds lb, ub, except for the angle p[5] which is wrapped to [-pi/2, pi/2) instead
+    (give it infinite bounds) so the solver can rotate through +-pi/2 rather than getting stuck on a bound there.
+    Memory use does not depend on the image size.
+    Returns (p, cost, nfev, status, JtJ) with the same ftol/xtol/gtol and status meaning as scipy's least_squares
+    (see _fit_status_reasons) and JtJ the J^T J at p. If the time.perf_counter() deadline passes it stops with the
+    best parameters so far and status _status_deadline"""
+    p = p0.copy()
+    dtype = image.dtype
+    JtJ, Jtr, cost = normal_equations(x, y, image, p.astype(dtype))
+    nfev = 1
+    damping = 1e-3
+    while nfev < maxfev:
+        if deadline is not None and time.perf_counter() > deadline:
+            return p, cost, nfev, _status_deadline, JtJ
+        scale = np.maximum(np.diag(JtJ), 1e-12)
+        if cost == 0 or np.max(np.abs(Jtr) / np.sqrt(scale)) < gtol * np.sqrt(2 * cost):
+            return p, cost, nfev, 1, JtJ
+        try:
+            step = np.linalg.solve(JtJ + damping * np.diag(scale), -Jtr)
+        except np.linalg.LinAlgError:
+            damping *= 10
+            continue
+        p_new = np.minimum(np.maximum(p + step, lb), ub)
+        p_new[5] = _wrap_angle(p_new[5])
+        JtJ_new, Jtr_new, cost_new = normal_equations(x, y, image, p_new.astype(dtype))
+        nfev += 1
+        if cost_new < cost:
+            ftol_reached = cost - cost_new < ftol * cost
+            xtol_reached = np.linalg.norm(p_new - p) < xtol * (xtol + np.linalg.norm(p))
+            p, JtJ, Jtr, cost = p_new, JtJ_new, Jtr_new, cost_new
+            if ftol_reached or xtol_reached:
+                return p, cost, nfev, 4 if ftol_reached and xtol_reached else 2 if ftol_reached else 3, JtJ
+            damping = max(damping / 3, 1e-10)
+        else:
+            if np.linalg.norm(p_new - p) < xtol * (xtol + np.linalg.norm(p)):
+                return p, cost, nfev, 3, JtJ  # cost at its rounding floor (noise free float32 frames)
+            damping *= 10
+            if damping > 1e10:
+                return p, cost, nfev, _status_damping_limit, JtJ
+    return p, cost, nfev, 0, JtJ
+
+
+# ----- startup: jit warm up and ahead of time compiled kernels -----
+_normal_equations_signatures = [
+    "(float64[::1], float64[::1], float64[:, ::1], float64[::1])",
+    "(float32[::1], float32[::1], float32[:, ::1], float32[::1])",
+]
+_aot_module_prefix = "_gaussian_kernels_aot_"
+
+
+def _warmup_kernels(parallel):
+    """compiles every kernel for its signatures and returns the seconds it took"""
+    start_time = time.perf_counter()
+    kernels = [(rotated_2D_gaussian, _gaussian_kernel_signatures), (model_and_jac, _gaussian_kernel_signatures)]
+    kernels.append((_gaussian_normal_equations, _normal_equations_signatures))
+    kernels.append((multi_model_and_jac, ["(float64[::1], float64[::1], float64[::1])"]))
+    image_types = ("float64", "float32", "uint16", "uint8")
+    row_sums_types = {t: np.dtype(_row_sums_dtype(t)).name for t in image_types}
+    kernels.append((_robust_peaks, [f"({t}[:, :, ::1], int64, {row_sums_types[t]}[::1])" for t in image_types]))
+    kernels.append((_marginals, [f"({t}[:, ::1],)" for t in image_types]))
+    kernels.append((_fit_gaussian_1D, ["(float64[::1], float64[::1], int64, float64, float64)"]))
+    if parallel:
+        kernels.append((_rotated_2D_gaussian_parallel, _gaussian_kernel_signatures))
+        kernels.append((_model_and_jac_parallel, _gaussian_kernel_signatures))
+        kernels.append((_gaussian_normal_equations_parallel, _normal_equations_signatures))
+    for kernel, signatures in kernels:
+        for signature in signatures:
+            kernel.compile(signature)
+    return time.perf_counter() - start_time
+
+
+def warmup(background=False, parallel=True):
+    """Compiles (or loads from the numba cache) all gaussian fit kernels for float64 and float32 (and the peak finder
+    and marginal kernels for common camera dtypes), so the first fit does not stall for seconds. Returns the seconds it took.
+    With background=True it runs in a thread (see run_as_thread) and returns the thread instead, e.g. to call it while
+    a GUI is being built. A fit started meanwhile waits only for the kernels it needs. parallel=False skips the
+    multithreaded kernels. Call it from the main thread: it starts the numba thread pool there first, since a TBB pool
+    started from another thread hangs the interpreter at exit"""
+    if parallel:
+        numba.get_num_threads()  # starts the thread pool in the calling thread
+    if background:
+        return run_as_thread(_warmup_kernels, parallel)
+    return _warmup_kernels(parallel)
+
+
+def _aot_module_name():
+    """name of the ahead of time kernel module, including a checksum of the kernel sources so stale builds are not loaded"""
+    functions = [_gaussian_row, _model_and_jac_row, rotated_2D_gaussian, model_and_jac, _normal_equations_row]
+    functions += [_unpack_normal_equations, _gaussian_normal_equations]
+    source = "".join(inspect.getsource(function.py_func) for function in functions)
+    return f"{_aot_module_prefix}{zlib.crc32(source.encode()):08x}"
+
+
+def build_aot_kernels(output_dir=None):
+    """Compiles the serial fit kernels (rotated_2D_gaussian, model_and_jac, _gaussian_normal_equations) for float64
+    and float32 ahead of time with numba.pycc into an extension module in output_dir (default: next to this file)
+    and uses it from then on. Fits then run without any jit compilation or numba cache, e.g. for frozen
+    applications. Built next to this file, it is also loaded at import in later processes; built into another
+    output_dir, later processes load it with use_aot_kernels(directory=output_dir).
+    The threaded kernels (parallel=True or "auto" on large frames) stay jit compiled.
+    The module name contains a checksum of the kernel sources, so it has to be rebuilt after changing them.
+    Needs a C compiler; numba.pycc is deprecated by numba. Returns the path of the module"""
+    from numba.pycc import CC
+
+    cc = CC(_aot_module_name())
+    cc.output_dir = output_dir or os.path.dirname(os.path.abspath(__file__))
+    for t in ("float64", "float32"):
+        args = f"{t}[::1], {t}[::1], " + ", ".join([t] * 7)
+        cc.export(f"rotated_2D_gaussian_{t}", f"{t}[:, ::1]({args})")(rotated_2D_gaussian.py_func)
+        cc.export(f"model_and_jac_{t}", f"UniTuple({t}[:], 8)({args})")(model_and_jac.py_func)
+        normal_equations_signature = f"Tuple((float64[:, ::1], float64[::1], float64))({t}[::1], {t}[::1], {t}[:, ::1], {t}[::1])"
+        cc.export(f"_gaussian_normal_equations_{t}", normal_equations_signature)(_gaussian_normal_equations.py_func)
+    cc.compile()
+    global _aot_kernels, _aot_directory
+    _aot_directory = None if output_dir is None else cc.output_dir
+    _aot_kernels = _load_aot_kernels(_aot_directory)
+    return os.path.join(cc.output_dir, cc.output_file)
+
+
+def _load_aot_kernels(directory=None):
+    """returns the module built by build_aot_kernels in directory (default: next to this file, imported as a sibling
+    module) or None if it does not exist (for the current kernel sources)"""
+    try:
+        name = _aot_module_name()
+        if directory is None:
+            if __package__:
+                return importlib.import_module("." + name, __package__)
+            return importlib.import_module(name)
+        for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+            path = os.path.join(directory, name + suffix)
+            if os.path.isfile(path):
+                spec = importlib.util.spec_from_file_location(name, path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                return module
+        return None
+    except (ImportError, OSError, TypeError):  # TypeError/OSError: sources not available (e.g. frozen without .py files)
+        return None
+
+
+def use_aot_kernels(enabled=True, directory=None):
+    """Switches between the ahead of time compiled kernels of build_aot_kernels and the jit compiled ones. directory is
+    the output_dir the kernels were built into (default: the output_dir of the last build_aot_kernels call of this
+    process, else next to this file, where they are also loaded at import). Returns True if the ahead of time kernels
+    are used"""
+    global _aot_kernels, _aot_directory
+    if directory is not None:
+        _aot_directory = os.path.abspath(directory)
+    _aot_kernels = _load_aot_kernels(_aot_directory) if enabled else None
+    return _aot_kernels is not None
+
+
+def _serial_kernel(name, dtype):
+    """returns the serial kernel name (model_and_jac or _gaussian_normal_equations) for dtype, ahead of time compiled if loaded"""
+    if _aot_kernels is None:
+        return globals()[name]
+    return getattr(_aot_kernels, f"{name}_{np.dtype(dtype).name}")
+
+
+_aot_directory = None  # output_dir of build_aot_kernels or use_aot_kernels if not next to this file
+_aot_kernels = _load_aot_kernels()
+
+
+# ----- region of interest -----
+def auto_roi(image, size_factor=4.0, min_size=16):
+    """Returns a region of interest (x_start, x_stop, y_start, y_stop) of size_factor times the estimated 1/e² diameter
+    (at least min_size pixels) centered on the peak of image. The diameter is estimated with estimate_gaussian_widths
+    on the part of the image above 1/e² of the peak (relative to the image mean as baseline) so the background and its
+    noise do not inflate it."""
+    image = np.asarray(image)
+    h, w = image.shape
+    peak_x, peak_y, diameter = _estimate_beam_diameter(image)
+    return _roi_around(peak_x, peak_y, max(min_size, size_factor * diameter), h, w)
+
+
+def _estimate_beam_diameter(image):
+    """returns (peak_x, peak_y, diameter) with the 1/e² diameter estimated from the pixels above 1/e² of the peak
+    relative to the image mean"""
+    baseline = float(image.mean())
+    peak_y, peak_x = peak_pos_2D(image)
+    row, col = round(peak_y), round(peak_x)
+    peak_value = float(image[max(0, row - 1) : row + 2, max(0, col - 1) : col + 2].max())  # sub-pixel peak between pixels
+    beam = image - baseline
+    beam[beam < (peak_value - baseline) * np.exp(-2)] = 0
+    return peak_x, peak_y, estimate_gaussian_widths(beam)
+
+
+def _roi_around(x, y, size, h, w):
+    """returns the (x_start, x_stop, y_start, y_stop) window of size pixels centered on x, y clipped to a h x w frame"""
+    half_size = size / 2
+    x_start = max(0, int(x - half_size))
+    y_start = max(0, int(y - half_size))
+    x_stop = min(w, int(np.ceil(x + half_size)) + 1)
+    y_stop = min(h, int(np.ceil(y + half_size)) + 1)
+    return x_start, x_stop, y_start, y_stop
+
+
+# ----- pixel subsampling -----
+_subsample_samples_per_diameter = 16  # samples across the 1/e² diameter kept by subsample="auto"
+
+
+def subsample_indices(h, w, stride=None, n_pixels=None, random=False, seed=0):
+    """Returns sorted (rows, cols) index arrays of a subsampled h x w pixel grid for fit_2D_gaussian(subsample=...).
+    Either every stride-th row and column is kept or about n_pixels pixels with the rows and columns spread in the
+    aspect ratio of the frame. random=True draws the rows and columns at random (with seed) instead of evenly spaced.
+    Only whole rows and columns are selected so the separable kernels still evaluate the subset in one pass"""
+    if (stride is None) == (n_pixels is None):
+        raise ValueError("give either stride or n_pixels")
+    if stride is not None:
+        n_rows, n_cols = -(-h // int(stride)), -(-w // int(stride))
+    else:
+        n_cols = min(w, max(2, int(round(np.sqrt(n_pixels * w / h)))))
+        n_rows = min(h, max(2, int(round(n_pixels / n_cols))))
+    if random:
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.choice(h, n_rows, replace=False)), np.sort(rng.choice(w, n_cols, replace=False))
+    if stride is not None:
+        return np.arange(0, h, int(stride)), np.arange(0, w, int(stride))
+    return np.unique(np.linspace(0, h - 1, n_rows).round().astype(int)), np.unique(np.linspace(0, w - 1, n_cols).round().astype(int))
+
+
+def _resolve_subsample(image, subsample, initial_guess):
+    """returns the (rows, cols) of the subsample argument of fit_2D_gaussian or None for all pixels"""
+    h, w = image.shape
+    if isinstance(subsample, str):
+        if subsample != "auto":
+            raise ValueError(f'subsample has to be None, a stride, "auto" or (rows, cols), got {subsample!r}')
+        if initial_guess is None:
+            coarse = max(1, min(h, w) // 256)  # the estimate does not need all pixels of large frames
+            diameter = coarse * _estimate_beam_diameter(image[::coarse, ::coarse])[2]
+        else:
+            diameter = min(initial_guess[3], initial_guess[4])
+        stride = int(diameter / _subsample_samples_per_diameter)
+        stride = max(1, min(stride, min(h, w) // 16))  # keep enough rows and columns for the bounds and guesses
+        return None if stride == 1 else subsample_indices(h, w, stride=stride)
+    if isinstance(subsample, (int, np.integer)):
+        return None if int(subsample) <= 1 else subsample_indices(h, w, stride=int(subsample))
+    rows, cols = (np.asarray(v, dtype=np.intp) for v in subsample)
+    return rows, cols
+
+
+# ----- fast fitter -----
+class _model_eval_cache:
+    """Evaluates evaluate(p) (e.g. model_and_jac) and remembers the last parameter vector and output, so the residual
+    and the Jacobian callback of least_squares at the same parameters share one kernel call. Counts hits and misses"""
+
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+        self.key = None
+        self.value = None
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, p):
+        key = np.asarray(p, dtype=np.float64).tobytes()
+        if key == self.key:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.key = key
+            self.value = self.evaluate(p)
+        return self.value
+
+
+def _gaussian_covariance(JtJ, cost, n_pixels):
+    """returns (covariance, std_errors) of the fit parameters from J^T J at the solution and the cost 0.5*sum(r²),
+    with the residual variance estimated as 2*cost/(n_pixels - n_params)"""
+    n_params = JtJ.shape[0]
+    residual_variance = 2 * cost / max(n_pixels - n_params, 1)
+    covariance = np.linalg.pinv(np.asarray(JtJ, dtype=np.float64)) * residual_variance
+    return covariance, np.sqrt(np.maximum(np.diag(covariance), 0))
+
+
+class _fit_deadline_exceeded(Exception):
+    """raised inside the least_squares residual callback when the time budget of the fit is used up"""
+
+
+def _fit_2D_gaussian_no_roi(
+    image, maxfev, initial_guess, info, solver="trf", deadline=None, parallel="auto", grids=None, frame_shape=None, value_range=None
+):
+    """fits the whole image. grids are the (x, y) pixel coordinates of the image columns and rows if it is a subsampled
+    frame (see subsample_indices), by default 0..w-1 and 0..h-1. The parameter bounds come from the (h, w) frame_shape
+    and (min, max) value_range of the frame the image was sampled from (default: the image itself), since a subsample
+    can miss the peak and the last rows and columns"""
+    if solver not in ("trf", "lm"):
+        raise ValueError(f'solver has to be "trf" or "lm", got {solver!r}')
+    vmin, vmax = (float(image.min()), float(image.max())) if value_range is None else value_range
+    vrange = vmax - vmin
+    if vrange == 0:
+        info["status"] = _status_flat_image
+        return None
+
+    if grids is None:
+        x, y = _get_grids(*image.shape, image.dtype)
+        spacing = 1.0
+    else:
+        x, y = (np.ascontiguousarray(v, dtype=image.dtype) for v in grids)
+        spacing = float(x[-1] - x[0]) / max(x.size - 1, 1)
+    h, w = image.shape if frame_shape is None else frame_shape
+
+    if initial_guess is None:
+        peak_y, peak_x = peak_pos_2D(image)
+        Dxy = spacing * estimate_gaussian_widths(image)
+        peak_x = np.interp(peak_x, np.arange(x.size), x)  # sub-pixel index to (possibly subsampled) coordinates
+        peak_y = np.interp(peak_y, np.arange(y.size), y)
+        initial_guess = [vrange, peak_x, peak_y, Dxy, Dxy, 0.0, vmin]
+
+    # phi is periodic (wrapped to [-pi/2, pi/2) by _wrap_angle) rather than bounded: a bound at +-pi/2 traps fits of
+    # beams rotated close to it
+    lb = np.array([0.0, 0.01 * w, 0.01 * h, 3.0, 3.0, -np.inf, vmin - vrange / 10], dtype=np.float64)
+    ub = np.array([1.1 * vrange, 0.99 * w, 0.99 * h, w, h, np.inf, vmin + 0.9 * vrange], dtype=np.float64)
+
+    p0 = np.array(initial_guess, dtype=np.float64)
+    p0[5] = _wrap_angle(p0[5])
+    span = np.where(np.isfinite(lb) & np.isfinite(ub), ub - lb, 0.0)
+    p0 = np.minimum(np.maximum(p0, lb + 0.01 * span), ub - 0.01 * span)
+
+    use_parallel = _use_parallel_kernels(image.size, parallel)
+    if solver == "lm":
+        if use_parallel:
+            normal_equations = _gaussian_normal_equations_parallel
+        else:
+            normal_equations = _serial_kernel("_gaussian_normal_equations", image.dtype)
+        p, cost, nfev, status, JtJ = _solve_gaussian_lm(
+            x, y, image, p0, lb, ub, maxfev, deadline=deadline, normal_equations=normal_equations
+        )
+        info["nfev"] += nfev
+        info["njev"] += nfev  # every evaluation of the normal equations includes the Jacobian
+        info["status"], info["cost"] = status, float(cost)
+        info["partial"] |= status == _status_deadline
+        if status <= 0 and status != _status_deadline:
+            return None
+        if "covariance" in info:
+            info["covariance"], info["std_errors"] = _gaussian_covariance(JtJ, cost, image.size)
+        return (*p, float(np.sqrt(2 * cost / image.size)))
+
+    target = image.ravel()
+    kernel = _model_and_jac_parallel if use_parallel else _serial_kernel("model_and_jac", image.dtype)
+    model = _model_eval_cache(lambda p: kernel(x, y, *np.asarray(p, dtype=x.dtype)))
+    best = {"cost": np.inf, "p": p0, "nfev": 0, "njev": 0}
+
+    def fun(p):
+        if deadline is not None:
+            if best["nfev"] > 0 and time.perf_counter() > deadline:
+                raise _fit_deadline_exceeded
+            best["nfev"] += 1
+        m, *_ = model(p)
+        residual = m - target
+        if deadline is not None:
+            cost = float(np.dot(residual, residual))
+            if cost < best["cost"]:
+                best.update(cost=cost, p=np.array(p))
+        return residual
+
+    def jac(p):
+        best["njev"] += 1
+        _, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi, J_off = model(p)
+        return np.column_stack([J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi, J_off])
+
+    try:
+        res = least_squares(
+            fun,
+            x0=p0,
+            bounds=(lb, ub),
+            jac=jac,
+            method="trf",
+            x_scale="jac",
+            ftol=1e-6,
+            gtol=1e-6,
+            xtol=1e-6,
+            max_nfev=maxfev,
+            verbose=0,
+        )
+    except _fit_deadline_exceeded:
+        info["nfev"] += best["nfev"]
+        info["njev"] += best["njev"]
+        info["status"], info["cost"] = _status_deadline, best["cost"] / 2
+        info["cache_hits"] += model.hits
+        info["cache_misses"] += model.misses
+        info["partial"] = True
+        if "covariance" in info:
+            info["covariance"] = info["std_errors"] = None  # no Jacobian at the best parameters
+        p = best["p"].copy()
+        p[5] = _wrap_angle(p[5])
+        return (*p, float(np.sqrt(best["cost"] / image.size)))
+    info["nfev"] += res.nfev
+    info["njev"] += res.njev
+    info["status"], info["cost"] = res.status, float(res.cost)
+    info["cache_hits"] += model.hits
+    info["cache_misses"] += model.misses
+    if not res.success:
+        return None
+    if "covariance" in info:
+        J = res.jac.astype(np.float64)
+        info["covariance"], info["std_errors"] = _gaussian_covariance(J.T @ J, res.cost, image.size)
+
+    rms = float(np.sqrt(np.mean(res.fun * res.fun, dtype=np.float64)))
+    p = res.x.copy()
+    p[5] = _wrap_angle(p[5])
+    return (*p, rms)
+
+
+# ----- coarse to fine pyramid -----
+def bin_image(image, bin_size):
+    """returns image averaged over bin_size x bin_size blocks. Incomplete blocks at the right and bottom edge are dropped"""
+    h, w = image.shape
+    hb, wb = h // bin_size, w // bin_size
+    return np.ascontiguousarray(image[: hb * bin_size, : wb * bin_size].reshape(hb, bin_size, wb, bin_size).mean(axis=(1, 3)))
+
+
+def _scale_gaussian_params(params, from_bin, to_bin):
+    """converts gaussian parameters between binning levels. Pixel i of a bin_size level is centered at bin_size*i+(bin_size-1)/2 in full resolution"""
+    A, x0, y0, Dx, Dy, phi, offset = params[:7]
+    x0 = (from_bin * x0 + (from_bin - 1) / 2 - (to_bin - 1) / 2) / to_bin
+    y0 = (from_bin * y0 + (from_bin - 1) / 2 - (to_bin - 1) / 2) / to_bin
+    scale = from_bin / to_bin
+    return [A, x0, y0, Dx * scale, Dy * scale, phi, offset]
+
+
+def _canonical_gaussian_params(params):
+    """returns gaussian parameters (A, x0, y0, Dx, Dy, phi, offset) with Dx >= Dy and phi in [-pi/2, pi/2), since
+    (Dx, Dy, phi) and (Dy, Dx, phi + pi/2) describe the same beam"""
+    A, x0, y0, Dx, Dy, phi, offset = params[:7]
+    if Dx < Dy:
+        Dx, Dy, phi = Dy, Dx, phi + np.pi / 2
+    return [A, x0, y0, Dx, Dy, _wrap_angle(phi), offset]
+
+
+def _width_on_bound(params, shape):
+    """True if a diameter of the gaussian parameters is on its bound in _fit_2D_gaussian_no_roi (3 px or the image size)"""
+    h, w = shape
+    Dx, Dy = params[3], params[4]
+    return min(Dx, Dy) <= 3.0 * (1 + 1e-6) or Dx >= w * (1 - 1e-6) or Dy >= h * (1 - 1e-6)
+
+
+def _fit_2D_gaussian_pyramid(image, maxfev, initial_guess, pyramid_bin, info, solver, deadline=None, parallel="auto"):
+    """fits image first binned by pyramid_bin and then at half the binning per level down to full resolution. Every
+    level starts from the scaled result of the previous one in canonical form (Dx >= Dy), so a level does not inherit
+    the axis order the coarse level happened to pick. If the full resolution fit fails or ends with a diameter on its
+    bound it is refitted once with the axes swapped (major axis rotated by 90 degrees) and the better fit is kept.
+    Appends (bin_size, seconds) per level to info["level_times_s"].
+    If the deadline passes before the full resolution level the last level result is returned scaled to full resolution"""
+    bin_sizes = []
+    bin_size = int(pyramid_bin)
+    while bin_size > 1:
+        if min(image.shape) // bin_size >= 8:  # coarser levels would be too small to fit
+            bin_sizes.append(bin_size)
+        bin_size //= 2
+    bin_sizes.append(1)
+
+    level_bin, result = 1, None
+    if initial_guess is not None:
+        result = list(initial_guess)
+    for bin_size in bin_sizes:
+        start_time = time.perf_counter()
+        if deadline is not None and start_time > deadline and level_bin > 1:
+            info["partial"] = True
+            info["status"] = _status_deadline
+            if "covariance" in info:
+                info["covariance"] = info["std_errors"] = None  # only known for the binned level
+            return (*_scale_gaussian_params(result, level_bin, 1), result[7])
+        level_guess = None
+        if result is not None:
+            level_guess = _canonical_gaussian_params(_scale_gaussian_params(result, level_bin, bin_size))
+        level_image = image if bin_size == 1 else bin_image(image, bin_size)
+        level_result = _fit_2D_gaussian_no_roi(level_image, maxfev, level_guess, info, solver, deadline, parallel)
+        info["level_times_s"].append((bin_size, time.perf_counter() - start_time))
+        if level_result is not None:
+            result, level_bin = level_result, bin_size
+
+    if result is None or info["partial"] or (level_result is not None and not _width_on_bound(level_result, image.shape)):
+        return level_result
+    start_time = time.perf_counter()
+    A, x0, y0, Dx, Dy, phi, offset = _scale_gaussian_params(result, level_bin, 1)
+    kept_info = {key: info[key] for key in ("status", "cost", "partial", "covariance", "std_errors") if key in info}
+    swapped = _fit_2D_gaussian_no_roi(image, maxfev, [A, x0, y0, Dy, Dx, phi, offset], info, solver, deadline, parallel)
+    info["level_times_s"].append((1, time.perf_counter() - start_time))
+    if swapped is not None and (level_result is None or swapped[7] < level_result[7]):
+        return swapped
+    info.update(kept_info)
+    return level_result
+
+
+def fit_2D_gaussian(
+    image,
+    maxfev=500,
+    initial_guess=None,
+    roi=None,
+    roi_size_factor=4.0,
+    pyramid_bin=None,
+    solver="trf",
+    dtype=np.float64,
+    float64_polish=False,
+    time_budget_s=None,
+    parallel="auto",
+    uncertainties=False,
+    subsample=None,
+    subsample_refine=False,
+    stats=None,
+    return_info=False,
+):
+    """Fits a rotated 2D gaussian (see rotated_2D_gaussian) to image and returns (A, x0, y0, Dx, Dy, phi, offset, rms)
+    with x horizontal and y vertical from top in pixels, or None if the fit failed.
+    initial_guess is in the same layout (without rms) and by default estimated from the image.
+    roi limits the fit to a part of the image: None fits the full frame, "auto" crops to roi_size_factor times the
+    estimated diameter around the peak (see auto_roi) and a tuple (x_start, x_stop, y_start, y_stop) crops to that
+    window. x0, y0 and initial_guess are always in full frame coordinates.
+    pyramid_bin (e.g. 4 or 8) enables coarse to fine fitting: the image is fitted binned by pyramid_bin first and
+    every following level halves the binning and starts from the previous result, so only the last refinement runs
+    at full resolution.
+    solver "trf" uses scipy's least_squares, "lm" the numba Levenberg-Marquardt solver that accumulates J^T J in one
+    pass over the pixels (constant memory, no N x 7 Jacobian) with the same bounds.
+    dtype=np.float32 converts the image and runs the numba kernels and grids in single precision (half the memory
+    traffic, enough for 8-16 bit cameras). float64_polish then refines the single precision result in float64.
+    time_budget_s limits the wall time of the fit: once it passed no further iteration (or pyramid level) is started
+    and the best parameters so far are returned with info["partial"] = True. The check runs in-process, so it costs
+    nothing on frames that finish in time.
+    parallel selects the multithreaded (rows split over numba threads, see set_fit_threads) or serial kernels. "auto"
+    uses the threaded ones only for frames (or levels) of at least _parallel_min_pixels pixels.
+    subsample fits only a subset of the pixels, which is enough for wide well sampled beams: an integer keeps every
+    subsample-th row and column, "auto" picks the stride so _subsample_samples_per_diameter samples span the estimated
+    diameter and sorted (rows, cols) index arrays (relative to the roi, see subsample_indices for fixed pixel counts
+    or random subsets) select any rows and columns. subsample_refine then continues from the subsampled result on all pixels,
+    which usually converges in one or two iterations. subsample can not be combined with pyramid_bin.
+    uncertainties=True adds "covariance" (7x7, in the order of initial_guess) and "std_errors" (7) to info, estimated
+    as s² (J^T J)^-1 from the J^T J of the final (full resolution) iteration with s² = 2*cost/(pixels - 7). Only a 7x7
+    pseudo inverse on top of the fit. They assume independent pixel noise and can be None if the fit ended partial.
+    stats (a FitStatistics) collects the info of every fit, e.g. to monitor timing percentiles and failure reasons of
+    a running acquisition.
+    If return_info is True it returns (result, info) with info a dict containing "roi", "level_times_s", a list of
+    (bin_size, seconds) per fitted pyramid level, "nfev", the number of function evaluations of all levels, and
+    "cache_hits"/"cache_misses" of the model evaluation shared between residual and Jacobian (trf solver only, the
+    cache misses are the actual kernel calls), "partial", "polish_time_s" if float64_polish was used and
+    "subsample_shape" (rows, cols) and "subsample_time_s" of the subsampled fit if subsample was used (a refinement
+    appears in "level_times_s"). Every fit also reports "time_s" (wall time of the call), "njev" (Jacobian
+    evaluations), "status" and "cost" (0.5*sum of squared residuals) of the last solver run, with status as in scipy's
+    least_squares (1 to 4 converged, 0 maxfev reached) or -2 (no decrease of the cost), -3 (time budget exceeded) and
+    -4 (flat image), and "failure", None or the reason why None was returned."""
+    fit_start_time = time.perf_counter()
+    deadline = None if time_budget_s is None else fit_start_time + time_budget_s
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float64, np.float32):
+        raise ValueError(f"dtype has to be np.float64 or np.float32, got {dtype!r}")
+    image = np.asarray(image, dtype=dtype, order="C")
+    h, w = image.shape
+    info = {"roi": (0, w, 0, h), "level_times_s": [], "nfev": 0, "njev": 0, "cache_hits": 0, "cache_misses": 0}
+    info.update(partial=False, status=None, cost=None)
+    if uncertainties:
+        info["covariance"] = info["std_errors"] = None
+
+    if roi is not None:
+        if isinstance(roi, str):
+            if roi != "auto":
+                raise ValueError(f'roi has to be None, "auto" or (x_start, x_stop, y_start, y_stop), got {roi!r}')
+            roi = auto_roi(image, size_factor=roi_size_factor)
+        info["roi"] = tuple(int(v) for v in roi)
+    x_start, x_stop, y_start, y_stop = info["roi"]
+    if roi is not None:
+        image = np.ascontiguousarray(image[y_start:y_stop, x_start:x_stop])
+        if initial_guess is not None:
+            initial_guess = np.array(initial_guess, dtype=np.float64)
+            initial_guess[1] -= x_start
+            initial_guess[2] -= y_start
+
+    rows_cols = None if subsample is None else _resolve_subsample(image, subsample, initial_guess)
+    if rows_cols is not None:
+        if pyramid_bin is not None:
+            raise ValueError("subsample and pyramid_bin can not be combined")
+        rows, cols = rows_cols
+        x, y = _get_grids(h, w, dtype)  # full frame grids, the roi offset is added at the end
+        info["subsample_shape"] = (rows.size, cols.size)
+        start_time = time.perf_counter()
+        sampled = np.ascontiguousarray(image[np.ix_(rows, cols)])
+        value_range = (float(image.min()), float(image.max()))  # the samples can miss the peak
+        result = _fit_2D_gaussian_no_roi(
+            sampled, maxfev, initial_guess, info, solver, deadline, parallel, (x[cols], y[rows]), image.shape, value_range
+        )
+        info["subsample_time_s"] = time.perf_counter() - start_time
+        if subsample_refine and result is not None and not info["partial"]:
+            start_time = time.perf_counter()
+            refined = _fit_2D_gaussian_no_roi(image, maxfev, result[:7], info, solver, deadline, parallel)
+            info["level_times_s"].append((1, time.perf_counter() - start_time))
+            if refined is not None:
+                result = refined
+    elif pyramid_bin is None:
+        start_time = time.perf_counter()
+        result = _fit_2D_gaussian_no_roi(image, maxfev, initial_guess, info, solver, deadline, parallel)
+        info["level_times_s"].append((1, time.perf_counter() - start_time))
+    else:
+        result = _fit_2D_gaussian_pyramid(image, maxfev, initial_guess, pyramid_bin, info, solver, deadline, parallel)
+
+    if float64_polish and dtype != np.float64 and result is not None and not info["partial"]:
+        start_time = time.perf_counter()
+        polished = _fit_2D_gaussian_no_roi(image.astype(np.float64), maxfev, result[:7], info, solver, deadline, parallel)
+        info["polish_time_s"] = time.perf_counter() - start_time
+        if polished is not None:
+            result = polished
+
+    if result is not None:
+        A, x0, y0, *rest = result
+        result = (A, x0 + x_start, y0 + y_start, *rest)
+    info["failure"] = None if result is not None else _fit_status_reasons.get(info["status"], "unknown")
+    info["time_s"] = time.perf_counter() - fit_start_time
+    if stats is not None:
+        stats.add(info)
+    if return_info:
+        return result, info
+    return result
+
+
+# ----- fit statistics -----
+class FitStatistics:
+    """Rolling statistics of fit_2D_gaussian calls (pass it as stats=). Keeps time_s, nfev, njev and cost of the last
+    window fits in preallocated ring buffers and counts statuses and failure reasons of all fits since the last reset.
+    add only writes a few scalars under a lock (a few microseconds), the percentiles are computed on summary(), so it
+    can stay enabled in a running acquisition. Thread safe"""
+
+    _fields = ("time_s", "nfev", "njev", "cost")
+
+    def __init__(self, window=1000):
+        if window < 1:
+            raise ValueError(f"window has to be at least 1, got {window}")
+        self.window = int(window)
+        self._lock = threading.Lock()
+        self._values = np.full((len(self._fields), self.window), np.nan)
+        self.reset()
+
+    def reset(self):
+        """forgets all collected fits"""
+        with self._lock:
+            self._values.fill(np.nan)
+            self._index = 0
+            self.n_fits = 0
+            self.n_failures = 0
+            self.n_partial = 0
+            self.status_counts = {}
+            self.failure_counts = {}
+
+    def add(self, info):
+        """adds the info dict of one fit (see fit_2D_gaussian)"""
+        cost = np.nan if info["cost"] is None else info["cost"]
+        with self._lock:
+            column = self._values[:, self._index]
+            column[0], column[1], column[2], column[3] = info["time_s"], info["nfev"], info["njev"], cost
+            self._index = (self._index + 1) % self.window
+            self.n_fits += 1
+            self.n_partial += info["partial"]
+            self.status_counts[info["status"]] = self.status_counts.get(info["status"], 0) + 1
+            if info["failure"] is not None:
+                self.n_failures += 1
+                self.failure_counts[info["failure"]] = self.failure_counts.get(info["failure"], 0) + 1
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """returns a dict with "n_fits", "n_failures", "failure_rate", "n_partial", "status_counts" and "failure_counts"
+        (histograms of all fits since the last reset) and per field of the last window fits a dict with "mean", "max"
+        and the percentiles as "p50", "p90", ..."""
+        with self._lock:
+            values = self._values[:, : min(self.n_fits, self.window)].copy()
+            out = {
+                "n_fits": self.n_fits,
+                "n_failures": self.n_failures,
+                "failure_rate": self.n_failures / self.n_fits if self.n_fits else 0.0,
+                "n_partial": self.n_partial,
+                "status_counts": dict(self.status_counts),
+                "failure_counts": dict(self.failure_counts),
+            }
+        for name, field in zip(self._fields, values):
+            field = field[np.isfinite(field)]
+            if field.size == 0:
+                out[name] = None
+                continue
+            out[name] = {"mean": float(field.mean()), "max": float(field.max())}
+            for q, v in zip(percentiles, np.percentile(field, percentiles)):
+                out[name][f"p{q:g}"] = float(v)
+        return out
+
+
+# ----- fit free second moment (D4sigma) beam analysis -----
+def _second_moments(image, x, y):
+    """returns (total, x_center, y_center, var_x, var_y, cov_xy) of image with the 1D column coordinates x and row coordinates y"""
+    row_sums = image.sum(axis=1)
+    col_sums = image.sum(axis=0)
+    total = row_sums.sum()
+    if total <= 0:
+        return None
+    x_center = col_sums @ x / total
+    y_center = row_sums @ y / total
+    dx = x - x_center
+    dy = y - y_center
+    var_x = col_sums @ (dx * dx) / total
+    var_y = row_sums @ (dy * dy) / total
+    cov_xy = dy @ (image @ dx) / total
+    return total, x_center, y_center, var_x, var_y, cov_xy
+
+
+def analyze_beam_D4sigma(image, offset=None, aperture_factor=3.0, max_iter=20, compute_rms=False):
+    """Fit free ISO 11146 beam analysis from the first and second moments of image. Returns the same layout as
+    fit_2D_gaussian (A, x0, y0, Dx, Dy, phi, offset, rms) with Dx the major and Dy the minor D4sigma (1/e²) diameter
+    and phi the angle of the major axis, or None if the image has no positive signal.
+    offset is the baseline subtracted before computing the moments and by default the mean of the outermost pixels.
+    The moments are iteratively recomputed in a rectangular aperture of aperture_factor times the diameters around the
+    centroid until the aperture does not change anymore (or max_iter is reached). The first aperture is auto_roi, so
+    background noise of large frames does not dominate the starting moments.
+    A is the peak of a gaussian with the same power and diameters. rms (residual of that gaussian) is NaN unless
+    compute_rms is True since it needs a full model evaluation."""
+    image = np.asarray(image, dtype=np.float64)
+    h, w = image.shape
+    if offset is None:
+        border_sum = image[0].sum() + image[-1].sum() + image[1:-1, 0].sum() + image[1:-1, -1].sum()
+        offset = border_sum / (2 * w + 2 * max(h - 2, 0))
+    x, y = _get_grids(h, w)
+
+    roi = auto_roi(image, size_factor=2 * aperture_factor)
+    for _ in range(max_iter):
+        x_start, x_stop, y_start, y_stop = roi
+        moments = _second_moments(image[y_start:y_stop, x_start:x_stop] - offset, x[x_start:x_stop], y[y_start:y_stop])
+        if moments is None:
+            return None
+        total, x0, y0, var_x, var_y, cov_xy = moments
+        mean_var = (var_x + var_y) / 2
+        diff = np.sqrt(((var_x - var_y) / 2) ** 2 + cov_xy**2)
+        if mean_var - diff <= 0:
+            return None
+        D_major = 4 * np.sqrt(mean_var + diff)
+        D_minor = 4 * np.sqrt(mean_var - diff)
+        phi = 0.5 * np.arctan2(2 * cov_xy, var_x - var_y)
+
+        c, s = np.cos(phi), np.sin(phi)
+        half_x = aperture_factor / 2 * np.hypot(D_major * c, D_minor * s)
+        half_y = aperture_factor / 2 * np.hypot(D_major * s, D_minor * c)
+        new_roi = (
+            max(0, int(x0 - half_x)),
+            min(w, int(np.ceil(x0 + half_x)) + 1),
+            max(0, int(y0 - half_y)),
+            min(h, int(np.ceil(y0 + half_y)) + 1),
+        )
+        if new_roi == roi:
+            break
+        roi = new_roi
+
+    A = 8 * total / (np.pi * D_major * D_minor)
+    rms = np.nan
+    if compute_rms:
+        residual = rotated_2D_gaussian(x, y, A, x0, y0, D_major, D_minor, phi, offset) - image
+        rms = np.sqrt(np.mean(residual * residual))
+    return (A, x0, y0, D_major, D_minor, phi, offset, rms)
+
+
+# ----- marginal projection (1D) fit -----
+@njit(fastmath=True, cache=True)
+def _marginals(image):
+    """returns the row sums (h,) and column sums (w,) of image in one pass over the pixels"""
+    h, w = image.shape
+    row_sums = np.zeros(h)
+    col_sums = np.zeros(w)
+    for i in range(h):
+        row = image[i]
+        total = 0.0
+        for j in range(w):
+            value = row[j]
+            total += value
+            col_sums[j] += value
+        row_sums[i] = total
+    return row_sums, col_sums
+
+
+@njit(fastmath=True, cache=True)
+def _gaussian_1D_normal_equations(values, p, JtJ, Jtr):
+    """fills J^T J (4x4) and J^T r (4) of a * exp(-8 (x - x0)² / D²) + c with x = 0..n-1 at p = (a, x0, D, c) and
+    returns the cost 0.5*sum(r²)"""
+    a, x0, D, c = p[0], p[1], p[2], p[3]
+    invD2 = 1.0 / (D * D)
+    JtJ[:] = 0.0
+    Jtr[:] = 0.0
+    J = np.empty(4)
+    cost = 0.0
+    for i in range(values.size):
+        dx = i - x0
+        g = np.exp(-8.0 * dx * dx * invD2)
+        r = a * g + c - values[i]
+        ag16 = 16.0 * a * g * invD2
+        J[0] = g
+        J[1] = ag16 * dx
+        J[2] = ag16 * dx * dx / D
+        J[3] = 1.0
+        for k in range(4):
+            Jtr[k] += J[k] * r
+            for m in range(k + 1):
+                JtJ[k, m] += J[k] * J[m]
+        cost += r * r
+    for k in range(4):
+        for m in range(k):
+            JtJ[m, k] = JtJ[k, m]
+    return 0.5 * cost
+
+
+@njit(cache=True)
+def _solve_4x4(M, b):
+    """solves M x = b by gaussian elimination with partial pivoting, returns (x, success)"""
+    M = M.copy()
+    x = b.copy()
+    for k in range(4):
+        pivot = k + np.argmax(np.abs(M[k:, k]))
+        if M[pivot, k] == 0.0:
+            return x, False
+        for m in range(4):
+            M[k, m], M[pivot, m] = M[pivot, m], M[k, m]
+        x[k], x[pivot] = x[pivot], x[k]
+        for i in range(k + 1, 4):
+            factor = M[i, k] / M[k, k]
+            M[i, k:] -= factor * M[k, k:]
+            x[i] -= factor * x[k]
+    for k in range(3, -1, -1):
+        x[k] = (x[k] - np.dot(M[k, k + 1 :], x[k + 1 :])) / M[k, k]
+    return x, True
+
+
+@njit(cache=True)
+def _fit_gaussian_1D(values, p0, maxfev, ftol, xtol):
+    """Levenberg-Marquardt fit of a * exp(-8 (x - x0)² / D²) + c to values at x = 0..n-1 starting from
+    p0 = (a, x0, D, c). D is kept >= 0.5. Returns (p, cost, nfev, success)"""
+    p = p0.copy()
+    JtJ = np.empty((4, 4))
+    Jtr = np.empty(4)
+    JtJ_new = np.empty((4, 4))
+    Jtr_new = np.empty(4)
+    cost = _gaussian_1D_normal_equations(values, p, JtJ, Jtr)
+    nfev = 1
+    damping = 1e-3
+    while nfev < maxfev:
+        scaled = JtJ.copy()
+        for k in range(4):
+            scaled[k, k] += damping * max(JtJ[k, k], 1e-12)
+        step, solved = _solve_4x4(scaled, -Jtr)
+        if not solved:
+            return p, cost, nfev, False
+        p_new = p + step
+        p_new[2] = max(p_new[2], 0.5)
+        cost_new = _gaussian_1D_normal_equations(values, p_new, JtJ_new, Jtr_new)
+        nfev += 1
+        small_step = np.sqrt(np.sum((p_new - p) ** 2)) < xtol * (xtol + np.sqrt(np.sum(p * p)))
+        if cost_new < cost:
+            converged = cost - cost_new < ftol * cost or small_step
+            p, cost = p_new, cost_new
+            JtJ[:] = JtJ_new
+            Jtr[:] = Jtr_new
+            if converged:
+                return p, cost, nfev, True
+            damping = max(damping / 3, 1e-10)
+        else:
+            if small_step:
+                return p, cost, nfev, True
+            damping *= 10
+            if damping > 1e10:
+                return p, cost, nfev, False
+    return p, cost, nfev, False
+
+
+def _gaussian_1D_guess(values):
+    """returns a starting point (a, x0, D, c) for _fit_gaussian_1D from the maximum, minimum and the full width at half
+    maximum of values"""
+    c = float(values.min())
+    a = float(values.max()) - c
+    x0 = float(np.argmax(values))
+    fwhm = max(1.0, float(np.count_nonzero(values > c + a / 2)))
+    return np.array([a, x0, fwhm * np.sqrt(2 / np.log(2)), c])  # 1/e² diameter of a gaussian with that FWHM
+
+
+def fit_2D_gaussian_marginals(image, maxfev=50, initial_guess=None, roi=None, compute_rms=False, return_info=False):
+    """Fast beam tracking: fits 1D gaussians to the column sums (x) and row sums (y) of image instead of the full 2D
+    model. Returns the layout of fit_2D_gaussian (A, x0, y0, Dx, Dy, phi, offset, rms) with phi = 0, or None if a fit
+    failed. Dx and Dy are the 1/e² diameters of the projections, i.e. of a rotated beam along x and y and not along its
+    axes. A and offset follow from the 1D amplitudes and offsets of both projections (averaged).
+    Both sums are computed in one numba pass over the pixels (any numeric dtype, no conversion) and the 1D fits only
+    see h + w values, so 1 MP frames take well below a millisecond.
+    initial_guess (full frame layout of fit_2D_gaussian, e.g. the last result) starts the 1D fits, by default they are
+    estimated from the projections. roi is None for the full frame, "auto" (see auto_roi) or (x_start, x_stop,
+    y_start, y_stop). rms (residual of the 2D gaussian) is NaN unless compute_rms is True since it needs a full model
+    evaluation. If return_info is True it returns (result, info) with info containing "roi" and "nfev" (x and y fit)."""
+    image = np.asarray(image)
+    h, w = image.shape
+    if roi is None:
+        roi = (0, w, 0, h)
+    elif isinstance(roi, str):
+        if roi != "auto":
+            raise ValueError(f'roi has to be None, "auto" or (x_start, x_stop, y_start, y_stop), got {roi!r}')
+        roi = auto_roi(image)
+    x_start, x_stop, y_start, y_stop = (int(v) for v in roi)
+    info = {"roi": (x_start, x_stop, y_start, y_stop), "nfev": 0}
+    window = np.ascontiguousarray(image[y_start:y_stop, x_start:x_stop])
+    row_sums, col_sums = _marginals(window)
+
+    guesses = [_gaussian_1D_guess(col_sums), _gaussian_1D_guess(row_sums)]
+    if initial_guess is not None:
+        A, x0, y0, Dx, Dy, _, offset = initial_guess[:7]
+        scale = np.sqrt(np.pi / 8)  # integral of exp(-8 t² / D²) over t is D * sqrt(pi / 8)
+        guesses = [
+            np.array([A * Dy * scale, x0 - x_start, Dx, offset * window.shape[0]]),
+            np.array([A * Dx * scale, y0 - y_start, Dy, offset * window.shape[1]]),
+        ]
+
+    fits = []
+    for values, guess in zip((col_sums, row_sums), guesses):
+        p, _, nfev, success = _fit_gaussian_1D(values, guess, maxfev, 1e-8, 1e-8)
+        info["nfev"] += nfev
+        if not success:
+            return (None, info) if return_info else None
+        fits.append(p)
+    (a_x, x0, Dx, c_x), (a_y, y0, Dy, c_y) = fits
+    scale = np.sqrt(np.pi / 8)
+    A = (a_x / (Dy * scale) + a_y / (Dx * scale)) / 2
+    offset = (c_x / window.shape[0] + c_y / window.shape[1]) / 2
+    x0, y0 = x0 + x_start, y0 + y_start
+
+    rms = np.nan
+    if compute_rms:
+        x, y = _get_grids(h, w)
+        residual = rotated_2D_gaussian(x, y, A, x0, y0, Dx, Dy, 0.0, offset) - image
+        rms = np.sqrt(np.mean(residual * residual))
+    result = (A, x0, y0, Dx, Dy, 0.0, offset, rms)
+    if return_info:
+        return result, info
+    return result
+
+
+# ----- warm started fitting of consecutive frames -----
+class GaussianTracker:
+    """Fits consecutive frames (e.g. of a live camera) with fit_2D_gaussian and uses the last converged parameters as
+    initial_guess of the next fit (warm start). With roi="auto" the window is placed around the last result instead of
+    being estimated from the frame. If the warm fit fails, its rms is larger than rms_jump_factor times the last rms or
+    its amplitude dropped below amplitude_drop_factor times the last amplitude (beam left the window) the frame is
+    fitted again with a cold start (default initial guess). Other keyword arguments are passed to
+    fit_2D_gaussian. saved_nfev estimates how many function evaluations the warm starts saved."""
+
+    def __init__(self, rms_jump_factor=2.0, amplitude_drop_factor=0.5, **fit_kwargs):
+        self.rms_jump_factor = rms_jump_factor
+        self.amplitude_drop_factor = amplitude_drop_factor
+        self.fit_kwargs = fit_kwargs
+        self.last_result = None
+        self.n_warm = 0
+        self.n_cold = 0
+        self.n_fallbacks = 0
+        self.nfev_warm = 0
+        self.nfev_cold = 0
+
+    def reset(self):
+        """forgets the last result so the next fit is a cold start"""
+        self.last_result = None
+
+    def fit(self, image):
+        """fits image and returns the fit_2D_gaussian result (or None if also the cold start failed)"""
+        if self.last_result is not None:
+            kwargs = dict(self.fit_kwargs)
+            if kwargs.get("roi") == "auto":
+                h, w = np.shape(image)
+                _, x0, y0, Dx, Dy, *_ = self.last_result
+                size = max(16, kwargs.get("roi_size_factor", 4.0) * max(Dx, Dy))
+                kwargs["roi"] = _roi_around(x0, y0, size, h, w)
+            result, info = fit_2D_gaussian(image, initial_guess=self.last_result[:7], return_info=True, **kwargs)
+            self.n_warm += 1
+            self.nfev_warm += info["nfev"]
+            if (
+                result is not None
+                and result[7] <= self.rms_jump_factor * self.last_result[7]
+                and result[0] >= self.amplitude_drop_factor * self.last_result[0]
+            ):
+                self.last_result = result
+                return result
+            self.n_fallbacks += 1
+
+        result, info = fit_2D_gaussian(image, return_info=True, **self.fit_kwargs)
+        self.n_cold += 1
+        self.nfev_cold += info["nfev"]
+        self.last_result = result
+        return result
+
+    @property
+    def saved_nfev(self):
+        """estimated function evaluations saved by the warm starts: warm fits times the mean cold start nfev minus the
+        nfev actually spent on warm fits (including warm fits that fell back to a cold start)"""
+        if self.n_cold == 0:
+            return 0
+        return self.n_warm * self.nfev_cold / self.n_cold - self.nfev_warm
+
+
+# ----- simultaneous fit of several gaussians -----
+@njit(fastmath=True, cache=True)
+def multi_model_and_jac(x, y, p):
+    """returns the raveled model and the (n_pixels, 6*K+1) Jacobian of K rotated gaussians with a shared offset,
+    p = [A, x0, y0, Dx, Dy, phi] * K + [offset], computing all components in one pass over the pixels"""
+    K = (p.size - 1) // 6
+    c = np.cos(p[5 : 6 * K : 6])
+    s = np.sin(p[5 : 6 * K : 6])
+    invDx2 = 1.0 / (p[3 : 6 * K : 6] * p[3 : 6 * K : 6])
+    invDy2 = 1.0 / (p[4 : 6 * K : 6] * p[4 : 6 * K : 6])
+    offset = p[6 * K]
+    n = y.size * x.size
+    m = np.empty(n)
+    J = np.empty((n, 6 * K + 1))
+    idx = 0
+    for i in range(y.size):
+        for j in range(x.size):
+            total = offset
+            for k in range(K):
+                A, Dx, Dy = p[6 * k], p[6 * k + 3], p[6 * k + 4]
+                x_shift = x[j] - p[6 * k + 1]
+                y_shift = y[i] - p[6 * k + 2]
+                xp = c[k] * x_shift + s[k] * y_shift
+                yp = -s[k] * x_shift + c[k] * y_shift
+                g = np.exp(-8.0 * (xp * xp * invDx2[k] + yp * yp * invDy2[k]))
+                Ag16 = 16.0 * A * g
+                J[idx, 6 * k] = g
+                J[idx, 6 * k + 1] = Ag16 * (c[k] * xp * invDx2[k] - s[k] * yp * invDy2[k])
+                J[idx, 6 * k + 2] = Ag16 * (s[k] * xp * invDx2[k] + c[k] * yp * invDy2[k])
+                J[idx, 6 * k + 3] = Ag16 * xp * xp * invDx2[k] / Dx
+                J[idx, 6 * k + 4] = Ag16 * yp * yp * invDy2[k] / Dy
+                J[idx, 6 * k + 5] = -Ag16 * xp * yp * (invDx2[k] - invDy2[k])
+                total += A * g
+            J[idx, 6 * K] = 1.0
+            m[idx] = total
+            idx += 1
+    return m, J
+
+
+def find_local_maxima_2D(image, n_peaks, min_distance=5):
+    """Returns up to n_peaks (row, column) positions of the highest local maxima of image that are at least
+    min_distance pixels apart, strongest first. The image is box filtered over (min_distance//2*2+1)² pixels first
+    so single noisy pixels do not count as maxima."""
+    image = np.asarray(image, dtype=np.float64)
+    r = max(1, min_distance // 2)
+    smooth = _box_filter(image, r)
+
+    padded = np.pad(smooth, 1, mode="constant", constant_values=-np.inf)
+    is_max = np.ones(smooth.shape, dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy or dx:
+                is_max &= smooth >= padded[1 + dy : 1 + dy + smooth.shape[0], 1 + dx : 1 + dx + smooth.shape[1]]
+    rows, cols = np.nonzero(is_max)
+    values = smooth[rows, cols]
+    order = np.argsort(values)[::-1][: 50 * n_peaks]
+
+    peaks = []
+    for row, col in zip(rows[order], cols[order]):
+        if all((row - r0) ** 2 + (col - c0) ** 2 >= min_distance**2 for r0, c0 in peaks):
+            peaks.append((int(row), int(col)))
+            if len(peaks) == n_peaks:
+                break
+    return peaks
+
+
+def fit_2D_multi_gaussian(image, n_components=2, maxfev=500, initial_guess=None, min_distance=5, return_info=False):
+    """Fits the sum of n_components rotated 2D gaussians with a shared offset to image (e.g. ghost reflections or
+    several beams). Returns (components, offset, rms) with components a (n_components, 6) array of rows
+    (A, x0, y0, Dx, Dy, phi) in the layout of fit_2D_gaussian, or None if the fit failed.
+    initial_guess is a flat [A, x0, y0, Dx, Dy, phi] * n_components + [offset]. By default every component starts at
+    one of the n_components highest local maxima (at least min_distance pixels apart, see find_local_maxima_2D) with
+    the diameter estimated from its neighbourhood.
+    All components are evaluated in one pass per pixel (multi_model_and_jac) and the trust region steps are solved
+    iteratively (lsmr), so the cost per iteration grows linearly with n_components.
+    If return_info is True it returns (result, info) with info containing "nfev" and "peaks" (the seed positions)."""
+    image = np.asarray(image, dtype=np.float64, order="C")
+    h, w = image.shape
+    vmin = float(image.min())
+    vrange = float(image.max()) - vmin
+    info = {"nfev": 0, "peaks": []}
+    result = None
+    if vrange > 0:
+        if initial_guess is None:
+            info["peaks"] = find_local_maxima_2D(image, n_components, min_distance)
+            if len(info["peaks"]) < n_components:
+                raise ValueError(f"found only {len(info['peaks'])} local maxima for {n_components} components")
+            initial_guess = []
+            for row, col in info["peaks"]:
+                half = 2 * min_distance
+                window = image[max(0, row - half) : row + half + 1, max(0, col - half) : col + half + 1]
+                D = estimate_gaussian_widths(window - window.min())
+                initial_guess += [image[row, col] - vmin, col, row, D, D, 0.0]
+            initial_guess.append(vmin)
+
+        lb_component = [0.0, 0.0, 0.0, 3.0, 3.0, -np.pi / 2]
+        ub_component = [1.1 * vrange, w - 1, h - 1, w, h, np.pi / 2]
+        lb = np.array(lb_component * n_components + [vmin - vrange / 10])
+        ub = np.array(ub_component * n_components + [vmin + 0.9 * vrange])
+        span = ub - lb
+        p0 = np.minimum(np.maximum(np.asarray(initial_guess, dtype=np.float64), lb + 0.01 * span), ub - 0.01 * span)
+
+        x, y = _get_grids(h, w)
+        target = image.ravel()
+        model = _model_eval_cache(lambda p: multi_model_and_jac(x, y, p))
+        res = least_squares(
+            lambda p: model(p)[0] - target,
+            x0=p0,
+            bounds=(lb, ub),
+            jac=lambda p: model(p)[1],
+            method="trf",
+            tr_solver="lsmr",
+            x_scale="jac",
+            ftol=1e-6,
+            gtol=1e-6,
+            xtol=1e-6,
+            max_nfev=maxfev,
+            verbose=0,
+        )
+        info["nfev"] = res.nfev
+        if res.success:
+            rms = float(np.sqrt(np.mean(res.fun * res.fun)))
+            result = (res.x[:-1].reshape(n_components, 6), float(res.x[-1]), rms)
+    if return_info:
+        return result, info
+    return result
+
+
+# ----- batched stack fitting -----
+GAUSSIAN_FIT_DTYPE = np.dtype(
+    [
+        ("A", np.float64),
+        ("x0", np.float64),
+        ("y0", np.float64),
+        ("Dx", np.float64),
+        ("Dy", np.float64),
+        ("phi", np.float64),
+        ("offset", np.float64),
+        ("rms", np.float64),
+        ("success", np.bool_),
+    ]
+)
+
+
+def _fill_gaussian_fit_results(results):
+    """converts a list of fit_2D_gaussian outputs (tuple or None) into a GAUSSIAN_FIT_DTYPE array. Failed fits are NaN with success=False"""
+    out = np.empty(len(results), dtype=GAUSSIAN_FIT_DTYPE)
+    names = GAUSSIAN_FIT_DTYPE.names[:-1]
+    for i, result in enumerate(results):
+        if result is None:
+            out[i] = (*[np.nan] * len(names), False)
+        else:
+            out[i] = (*result, True)
+    return out
+
+
+def _fit_2D_gaussian_guessed(image, initial_guess, **fit_kwargs):
+    """fit_2D_gaussian with the initial_guess as second positional argument (for executor.map over frames and guesses)"""
+    return fit_2D_gaussian(image, initial_guess=initial_guess, **fit_kwargs)
+
+
+def fit_2D_gaussian_stack(frames, workers=None, maxfev=500, chunksize=None, initial_guesses=None, **fit_kwargs):
+    """Fits fit_2D_gaussian to every frame of a stack and returns a structured array (dtype GAUSSIAN_FIT_DTYPE) with
+    the fields A, x0, y0, Dx, Dy, phi, offset, rms and success (failed fits are NaN with success=False).
+    frames can be a 3D array (n_frames, h, w) or any iterable of 2D frames.
+    The fits are distributed over a process pool with workers processes (default None = os.cpu_count()). Frames are
+    sent in chunks of chunksize frames (default: about 4 chunks per worker) and every worker keeps its own
+    _get_grids cache and loaded numba kernels for its whole lifetime, so the per-frame setup is paid once per worker.
+    workers<=1 fits in the calling process without a pool. Other keyword arguments are passed to fit_2D_gaussian. With
+    a pool the fits use the serial kernels (parallel=False) unless given, so processes and threads do not oversubscribe.
+    stats (see FitStatistics) is only supported with workers<=1.
+    initial_guesses are per frame initial guesses: None lets every fit estimate its own, "batch" computes all of them
+    in one vectorized pass before the fits (see gaussian_initial_guess_stack, needs a 3D array) and an (n_frames, 7)
+    array gives them directly.
+    Note: on Windows the call has to be guarded by if __name__ == "__main__": since the workers are spawned."""
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if isinstance(frames, np.ndarray):
+        if frames.ndim != 3:
+            raise ValueError(f"frames has to be 3D (n_frames, h, w), got shape {frames.shape}")
+        n_frames = len(frames)
+        initializer, initargs = _get_grids, frames.shape[1:]
+    else:
+        n_frames = None
+        initializer, initargs = None, ()
+
+    if isinstance(initial_guesses, str):
+        if initial_guesses != "batch" or n_frames is None:
+            raise ValueError('initial_guesses="batch" needs frames as 3D array')
+        initial_guesses = gaussian_initial_guess_stack(frames)
+    if initial_guesses is None:
+        fit, arguments = fit_2D_gaussian, (frames,)
+    else:
+        fit, arguments = _fit_2D_gaussian_guessed, (frames, initial_guesses)
+
+    if workers <= 1:
+        results = [fit(*frame_arguments, maxfev=maxfev, **fit_kwargs) for frame_arguments in zip(*arguments)]
+        return _fill_gaussian_fit_results(results)
+    if fit_kwargs.get("stats") is not None:
+        raise ValueError("stats can not be collected from worker processes, use workers=1")
+
+    fit_kwargs.setdefault("parallel", False)
+    if chunksize is None:
+        chunksize = max(1, n_frames // (4 * workers)) if n_frames is not None else 8
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        results = list(executor.map(partial(fit, maxfev=maxfev, **fit_kwargs), *arguments, chunksize=chunksize))
+    return _fill_gaussian_fit_results(results)
+
+
+# ----- rolling statistics of fit results -----
+class RollingBeamStatistics:
+    """Rolling mean, std, min and max of fit_2D_gaussian results (beam pointing and size stability) over the last
+    window fits and since the start (or the last reset), updated in O(1) per fit: Welford updates for mean and variance
+    (a replacing update once the window is full, recomputed exactly from the window every window fits so rounding
+    errors do not accumulate) and monotonic deques for the window min/max. fields are names of GAUSSIAN_FIT_DTYPE.
+    The history is kept in a circular buffer written twice (at i and i + window), so the last window results are always
+    one contiguous block: history(copy=False) returns it as numpy view without copying. Failed fits (None) are only
+    counted. phi is averaged as is (no wrapping at +-pi/2). Thread safe: the fit thread can add while the GUI reads"""
+
+    def __init__(self, window=100, fields=("x0", "y0", "Dx", "Dy", "phi")):
+        if window < 1:
+            raise ValueError(f"window has to be at least 1, got {window}")
+        self.window = int(window)
+        self.fields = tuple(fields)
+        self._indices = [GAUSSIAN_FIT_DTYPE.names.index(field) for field in self.fields]
+        self._lock = threading.RLock()
+        self._buffer = np.empty((2 * self.window, len(self.fields)))
+        self.reset()
+
+    def reset(self):
+        """forgets all results"""
+        n_fields = len(self.fields)
+        with self._lock:
+            self._next = 0  # buffer position of the next result (the oldest one once the window is full)
+            self.n_window = 0
+            self.n_total = 0
+            self.n_failed = 0
+            self._mean, self._m2 = np.zeros(n_fields), np.zeros(n_fields)
+            self._total_mean, self._total_m2 = np.zeros(n_fields), np.zeros(n_fields)
+            self._total_min, self._total_max = np.full(n_fields, np.inf), np.full(n_fields, -np.inf)
+            self._min_deques = [deque() for _ in self.fields]  # (fit number, value), values increasing
+            self._max_deques = [deque() for _ in self.fields]  # (fit number, value), values decreasing
+
+    def add(self, result):
+        """adds a fit_2D_gaussian result (A, x0, y0, Dx, Dy, phi, offset, rms) or None for a failed fit"""
+        if result is None:
+            with self._lock:
+                self.n_failed += 1
+            return
+        values = np.array([result[i] for i in self._indices], dtype=np.float64)
+        with self._lock:
+            oldest = self._buffer[self._next].copy()
+            self._buffer[self._next] = self._buffer[self._next + self.window] = values
+            self._next = (self._next + 1) % self.window
+
+            self.n_total += 1
+            delta = values - self._total_mean
+            self._total_mean += delta / self.n_total
+            self._total_m2 += delta * (values - self._total_mean)
+            np.minimum(self._total_min, values, out=self._total_min)
+            np.maximum(self._total_max, values, out=self._total_max)
+
+            if self.n_window < self.window:
+                self.n_window += 1
+                delta = values - self._mean
+                self._mean += delta / self.n_window
+                self._m2 += delta * (values - self._mean)
+            elif self._next == 0:  # the window is one contiguous block again, recompute it exactly
+                window = self._buffer[: self.window]
+                self._mean = window.mean(axis=0)
+                self._m2 = ((window - self._mean) ** 2).sum(axis=0)
+            else:  # replace the oldest value
+                old_mean = self._mean.copy()
+                self._mean += (values - oldest) / self.window
+                self._m2 += (values - oldest) * (values - self._mean + oldest - old_mean)
+
+            first_in_window = self.n_total - self.window
+            for k, value in enumerate(values.tolist()):
+                for deque_, keep in ((self._min_deques[k], float.__lt__), (self._max_deques[k], float.__gt__)):
+                    while deque_ and not keep(deque_[-1][1], value):
+                        deque_.pop()
+                    deque_.append((self.n_total, value))
+                    while deque_[0][0] <= first_in_window:
+                        deque_.popleft()
+
+    def history(self, copy=True):
+        """returns the last n_window results as (n_window, len(fields)) array, oldest first. copy=False returns a view
+        into the buffer without copying, which later adds overwrite (read it right away or hold the lock with
+        "with statistics.lock():" if the fit runs in another thread)"""
+        with self._lock:
+            if self.n_window < self.window:
+                view = self._buffer[: self.n_window]
+            else:
+                view = self._buffer[self._next : self._next + self.window]
+            return view.copy() if copy else view
+
+    def lock(self):
+        """the (reentrant) lock that add holds while it updates"""
+        return self._lock
+
+    def summary(self):
+        """returns a dict with "n_window", "n_total", "n_failed" and per field a dict with "mean", "std", "min", "max"
+        of the window and "total_mean", "total_std", "total_min", "total_max" since the start (NaN without results)"""
+        with self._lock:
+            out = {"n_window": self.n_window, "n_total": self.n_total, "n_failed": self.n_failed}
+            if self.n_total == 0:
+                nan = [np.nan] * len(self.fields)
+                window_stats = total_stats = [nan] * 4
+            else:
+                window_stats = [
+                    self._mean,
+                    np.sqrt(np.maximum(self._m2, 0) / self.n_window),
+                    [deque_[0][1] for deque_ in self._min_deques],
+                    [deque_[0][1] for deque_ in self._max_deques],
+                ]
+                total_stats = [
+                    self._total_mean,
+                    np.sqrt(np.maximum(self._total_m2, 0) / self.n_total),
+                    self._total_min,
+                    self._total_max,
+                ]
+            for k, field in enumerate(self.fields):
+                stats = dict(zip(("mean", "std", "min", "max"), (float(v[k]) for v in window_stats)))
+                stats.update(zip(("total_mean", "total_std", "total_min", "total_max"), (float(v[k]) for v in total_stats)))
+                out[field] = stats
+        return out
@@ -2,7 +2,7 @@
 
 import builtins
 import copy
-import inspect
+import importlib
 import os
 import sys
 import threading
@@ -12,20 +12,9 @@ from collections.abc import Sequence
 from concurrent.futures import ProcessPoolExecutor, TimeoutError
 from contextlib import contextmanager
 
-import numpy as np
-import serial.tools.list_ports  # install as pyserial
-from numba import njit
-from scipy.optimize import curve_fit, least_squares
-
 # autopep8: on
 
 
-def peak_pos_2D(image):
-    """returns x,y (vertical from top,horizonzal) positon of the peak in a 2D image"""
-    image = np.asanyarray(image)
-    return np.unravel_index(np.argmax(image), image.shape)
-
-
 def is_list(x):
     """returns True if x is a list type (aka sequence but no string)"""
     if isinstance(x, Sequence) and not isinstance(x, str):
@@ -207,34 +196,6 @@ def make_folder(path: str, file_path: bool = False, error_if_exist: bool = False
             os.makedirs(dir_name, exist_ok=not error_if_exist)
 
 
-def estimate_gaussian_widths(image):
-    """
-    Estimate 1/e² diameters (Dx, Dy) from second moments of the image.
-    Assumes image is already cropped to region of interest.
-    """
-    total = image.sum()
-    if total == 0:
-        return 1.0, 1.0  # fallback
-
-    nx, ny = image.shape
-    x, y = np.indices((nx, ny))
-
-    x_center = (x * image).sum() / total
-    y_center = (y * image).sum() / total
-
-    x2 = ((x - x_center) ** 2 * image).sum() / total
-    y2 = ((y - y_center) ** 2 * image).sum() / total
-
-    sigma_x = np.sqrt(x2)
-    sigma_y = np.sqrt(y2)
-
-    # Convert stddev to 1/e² diameter
-    D_x = 2 * np.sqrt(2) * sigma_x
-    D_y = 2 * np.sqrt(2) * sigma_y
-
-    return (D_x + D_y) / 2
-
-
 class returning_thread(threading.Thread):
     """same as threading.Thread but with return value of the threaded function"""
 
@@ -377,6 +338,8 @@ def add_number_to_path(path: str, number_prefix="_", has_file_ending: bool = Tru
 
 
 def get_available_com_ports() -> list[str]:
+    import serial.tools.list_ports  # install as pyserial
+
     return [str(elem) for elem in serial.tools.list_ports.comports()]  # nopep8 #type:ignore
 
 
@@ -420,6 +383,8 @@ def round_significant_simple(x, digits=4, return_string=False, fixed_length=Fals
             return 0
 
     # nonzero case
+    import numpy as np
+
     round_number = digits - int(np.floor(np.log10(abs(np.float64(x))))) - 1
     x_round = float(round(x, round_number))
 
@@ -463,143 +428,60 @@ def round_significant_simple(x, digits=4, return_string=False, fixed_length=Fals
             return x_float
 
 
-###############################################################
-from functools import lru_cache
-
-import numpy as np
-from numba import njit
-from scipy.optimize import least_squares
+# ----- lazily imported submodules -----
+# The gaussian beam fitting (numpy, numba, scipy) lives in gaussian_fitting.py and the camera frame processing
+# (numpy, numba) in image_processing.py. They are only imported when one of their names is first accessed here, so
+# scripts that only use the light helpers above do not pay for their import
+_gaussian_fitting_names = (
+    "peak_pos_2D",
+    "estimate_gaussian_widths",
+    "peak_pos_2D_stack",
+    "estimate_gaussian_widths_stack",
+    "gaussian_initial_guess_stack",
+    "rotated_2D_gaussian",
+    "model_and_jac",
+    "set_grid_cache_limits",
+    "grid_cache_info",
+    "clear_grid_cache",
+    "set_fit_threads",
+    "fit_threading_info",
+    "warmup",
+    "build_aot_kernels",
+    "use_aot_kernels",
+    "auto_roi",
+    "subsample_indices",
+    "bin_image",
+    "fit_2D_gaussian",
+    "FitStatistics",
+    "analyze_beam_D4sigma",
+    "fit_2D_gaussian_marginals",
+    "GaussianTracker",
+    "multi_model_and_jac",
+    "find_local_maxima_2D",
+    "fit_2D_multi_gaussian",
+    "GAUSSIAN_FIT_DTYPE",
+    "fit_2D_gaussian_stack",
+    "RollingBeamStatistics",
+)
+_image_processing_names = ("FrameAverager", "BackgroundManager", "SaturationDetector")
+_lazy_submodules = {"gaussian_fitting": _gaussian_fitting_names, "image_processing": _image_processing_names}
+# "from helper_functions import *" provides the lazy names too (resolved through __getattr__, so a star import loads the
+# submodules while a plain "import helper_functions" stays light), next to everything it provided without __all__
+__all__ = [name for name in globals() if not name.startswith("_")] + [*_gaussian_fitting_names, *_image_processing_names]
+
+
+def __getattr__(name):
+    for module_name, names in _lazy_submodules.items():
+        if name in names:
+            if __package__:
+                module = importlib.import_module("." + module_name, __package__)
+            else:
+                module = importlib.import_module(module_name)
+            value = getattr(module, name)
+            globals()[name] = value  # later accesses do not go through __getattr__ anymore
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-# ----- core model -----
-@njit(
-    "(float64[:,::1], float64[:,::1], float64, float64, float64, float64, float64, float64, float64)",
-    fastmath=True,
-    cache=True,
-)
-def rotated_2D_gaussian(x, y, A, x0, y0, D_1_over_e2_x, D_1_over_e2_y, phi, offset):
-    x_shift = x - x0
-    y_shift = y - y0
-    c = np.cos(phi)
-    s = np.sin(phi)
-    xp = c * x_shift + s * y_shift
-    yp = -s * x_shift + c * y_shift
-    t = xp / D_1_over_e2_x
-    u = yp / D_1_over_e2_y
-    return A * np.exp(-8.0 * (t * t + u * u)) + offset
-
-
-@njit(
-    "(float64[:,::1], float64[:,::1], float64, float64, float64, float64, float64, float64, float64)",
-    fastmath=True,
-    cache=True,
-)
-def model_and_jac(x, y, A, x0, y0, Dx, Dy, phi, offset):
-    x_shift = x - x0
-    y_shift = y - y0
-    c = np.cos(phi)
-    s = np.sin(phi)
-    xp = c * x_shift + s * y_shift
-    yp = -s * x_shift + c * y_shift
-    t = xp / Dx
-    u = yp / Dy
-    g = np.exp(-8.0 * (t * t + u * u))
-    invDx2 = 1.0 / (Dx * Dx)
-    invDy2 = 1.0 / (Dy * Dy)
-    # dE where E = -8*(t^2+u^2)
-    dE_dx0 = 16.0 * (c * xp * invDx2 - s * yp * invDy2)
-    dE_dy0 = 16.0 * (s * xp * invDx2 + c * yp * invDy2)
-    dE_dDx = 16.0 * ((xp * xp) / (Dx * Dx * Dx))
-    dE_dDy = 16.0 * ((yp * yp) / (Dy * Dy * Dy))
-    dxp_dphi = -s * x_shift + c * y_shift
-    dyp_dphi = -c * x_shift - s * y_shift
-    dE_dphi = -16.0 * (xp * dxp_dphi * invDx2 + yp * dyp_dphi * invDy2)
-
-    m = A * g + offset
-    J_A = g
-    J_x0 = A * g * dE_dx0
-    J_y0 = A * g * dE_dy0
-    J_Dx = A * g * dE_dDx
-    J_Dy = A * g * dE_dDy
-    J_phi = A * g * dE_dphi
-    J_offset = np.ones_like(g)
-
-    return (
-        m.ravel(),
-        J_A.ravel(),
-        J_x0.ravel(),
-        J_y0.ravel(),
-        J_Dx.ravel(),
-        J_Dy.ravel(),
-        J_phi.ravel(),
-        J_offset.ravel(),
-    )
-
-
-# ----- cached grids -----
-_grid_cache = {}
-
-
-def _get_grids(h, w):
-    key = (h, w)
-    g = _grid_cache.get(key)
-    if g is None:
-        y2D, x2D = np.mgrid[0:h, 0:w]
-        x2D = np.ascontiguousarray(x2D, dtype=np.float64)
-        y2D = np.ascontiguousarray(y2D, dtype=np.float64)
-        _grid_cache[key] = (x2D, y2D)
-        return x2D, y2D
-    return g
-
-
-# ----- fast fitter (no ROI) -----
-def fit_2D_gaussian(image, maxfev=500, initial_guess=None):
-    image = np.asarray(image, dtype=np.float64, order="C")
-    h, w = image.shape
-    vmin = float(image.min())
-    vmax = float(image.max())
-    vrange = vmax - vmin
-    if vrange == 0:
-        return None
-
-    if initial_guess is None:
-        peak_x, peak_y = peak_pos_2D(image)  # your function
-        Dxy = estimate_gaussian_widths(image)  # your function
-        initial_guess = [vrange, peak_x, peak_y, Dxy, Dxy, 0.0, vmin]
-
-    lb = np.array([0.0, 0.01 * w, 0.01 * h, 3.0, 3.0, -np.pi / 2, vmin - vrange / 10], dtype=np.float64)
-    ub = np.array([1.1 * vrange, 0.99 * w, 0.99 * h, w, h, np.pi / 2, vmin + 0.9 * vrange], dtype=np.float64)
-
-    p0 = np.asarray(initial_guess, dtype=np.float64)
-    span = ub - lb
-    p0 = np.minimum(np.maximum(p0, lb + 0.01 * span), ub - 0.01 * span)
-
-    x2D, y2D = _get_grids(h, w)
-    target = image.ravel()
-
-    def fun(p):
-        m, *_ = model_and_jac(x2D, y2D, *p)
-        return m - target
-
-    def jac(p):
-        _, J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi, J_off = model_and_jac(x2D, y2D, *p)
-        return np.column_stack([J_A, J_x0, J_y0, J_Dx, J_Dy, J_phi, J_off])
-
-    res = least_squares(
-        fun,
-        x0=p0,
-        bounds=(lb, ub),
-        jac=jac,
-        method="trf",
-        x_scale="jac",
-        ftol=1e-6,
-        gtol=1e-6,
-        xtol=1e-6,
-        max_nfev=maxfev,
-        verbose=0,
-    )
-    if not res.success:
-        return None
-
-    rms = np.sqrt(np.mean(res.fun * res.fun))
-    return (*res.x, rms)
+def __dir__():
+    return sorted(set(globals()).union(*_lazy_submodules.values()))
@@ -0,0 +1,406 @@
+# autopep8: off
+
+import os
+import threading
+
+import numpy as np
+from numba import njit
+
+if __package__:
+    from .helper_functions import create_data_lock
+else:
+    from helper_functions import create_data_lock
+
+# autopep8: on
+
+
+# ----- running frame average -----
+@njit(cache=True)
+def _boxcar_replace(total, slot, frame, evict):
+    """one pass over the pixels: removes the evicted frame in slot from the running sum (if evict), stores frame as
+    float32 in slot and adds it to the sum"""
+    for i in range(total.size):
+        value = np.float32(frame[i])
+        if evict:
+            total[i] += value - slot[i]
+        else:
+            total[i] += value
+        slot[i] = value
+
+
+@njit(cache=True)
+def _ema_update(average, frame, alpha):
+    """average += alpha * (frame - average) in one pass"""
+    for i in range(average.size):
+        average[i] += alpha * (np.float32(frame[i]) - average[i])
+
+
+class FrameAverager:
+    """Averages the last n_frames frames of a camera stream. mode "boxcar" keeps the frames in a preallocated float32
+    ring buffer with a running sum (float64 so adding and evicting does not drift), "ema" an exponential moving
+    average with alpha = 2/(n_frames+1) (the first frames are averaged equally until the weight drops to alpha).
+    add and evict are one pass over the pixels and allocate nothing after the first frame (or a shape change, which
+    restarts the average). n_frames and mode can be changed at any time: a smaller n_frames evicts the oldest frames
+    from the sum, a larger one keeps the history (the buffer is resized once, the sum is not recomputed), switching
+    to "ema" continues from the current boxcar average, switching to "boxcar" restarts. Thread safe: average copies
+    under the lock into an array the caller owns, so a frame added meanwhile does not change it"""
+
+    def __init__(self, n_frames=10, mode="boxcar"):
+        self._lock = threading.Lock()
+        self._n_frames = 1
+        self._mode = "boxcar"
+        self._buffer = None
+        self.count = 0
+        self.n_frames = n_frames
+        self.mode = mode
+
+    def reset(self):
+        """forgets all frames, the buffers are kept"""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._start = 0
+        self.count = 0
+        if self._buffer is not None:
+            self._sum.fill(0)
+
+    def _allocate(self, shape):
+        capacity = self._n_frames if self._mode == "boxcar" else 0
+        self._buffer = np.empty((capacity, *shape), dtype=np.float32)
+        self._sum = np.zeros(shape, dtype=np.float64)
+        self._average = np.zeros(shape, dtype=np.float32)
+        self._reset()
+
+    @property
+    def n_frames(self):
+        return self._n_frames
+
+    @n_frames.setter
+    def n_frames(self, n_frames):
+        n_frames = int(n_frames)
+        if n_frames < 1:
+            raise ValueError(f"n_frames has to be at least 1, got {n_frames}")
+        with self._lock:
+            self._n_frames = n_frames
+            if self._buffer is None or self._mode != "boxcar":
+                return
+            while self.count > n_frames:
+                self._evict_oldest()
+            # the kept frames are copied in order to the start of a buffer of n_frames frames
+            capacity = len(self._buffer)
+            buffer = np.empty((n_frames, *self._buffer.shape[1:]), dtype=np.float32)
+            buffer[: self.count] = self._buffer[(self._start + np.arange(self.count)) % capacity]
+            self._buffer, self._start = buffer, 0
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        if mode not in ("boxcar", "ema"):
+            raise ValueError(f'mode has to be "boxcar" or "ema", got {mode!r}')
+        with self._lock:
+            if mode == self._mode:
+                return
+            self._mode = mode
+            if self._buffer is None:
+                return
+            if mode == "ema":
+                if self.count > 0:
+                    np.multiply(self._sum, 1 / self.count, out=self._average, casting="unsafe")
+                self._buffer = np.empty((0, *self._average.shape), dtype=np.float32)  # the ema needs no history
+            else:
+                self._allocate(self._average.shape)
+
+    def _evict_oldest(self):
+        np.subtract(self._sum, self._buffer[self._start], out=self._sum)
+        self._start = (self._start + 1) % len(self._buffer)
+        self.count -= 1
+
+    def add(self, frame):
+        """adds a 2D frame of any real dtype"""
+        frame = np.asarray(frame)
+        with self._lock:
+            if self._buffer is None or frame.shape != self._sum.shape:
+                self._allocate(frame.shape)
+            flat = frame.reshape(-1)  # a view for contiguous frames
+            if self._mode == "ema":
+                if self.count == 0:
+                    np.copyto(self._average, frame, casting="unsafe")
+                else:
+                    _ema_update(self._average.reshape(-1), flat, max(2 / (self._n_frames + 1), 1 / (self.count + 1)))
+                self.count = min(self.count + 1, self._n_frames)
+                return
+            capacity = len(self._buffer)
+            evict = self.count == self._n_frames
+            if evict:
+                slot = self._start
+                self._start = (self._start + 1) % capacity
+            else:
+                slot = (self._start + self.count) % capacity
+                self.count += 1
+            _boxcar_replace(self._sum.reshape(-1), self._buffer[slot].reshape(-1), flat, evict)
+
+    def average(self, out=None):
+        """returns the current average as float32 array (None before the first frame), a new array or written to out
+        (e.g. a preallocated array of the GUI to not allocate per call)"""
+        with self._lock:
+            if self.count == 0:
+                return None
+            if out is None:
+                out = np.empty(self._average.shape, dtype=np.float32)
+            elif out.shape != self._average.shape:
+                raise ValueError(f"out shape {out.shape} differs from the frame shape {self._average.shape}")
+            if self._mode == "boxcar":
+                np.multiply(self._sum, 1 / self.count, out=out, casting="unsafe")
+            else:
+                np.copyto(out, self._average, casting="unsafe")
+            return out
+
+
+# ----- background (dark frame) subtraction -----
+@njit(cache=True)
+def _subtract_background(frame, background, out, clip):
+    """out = frame - background in one pass, values below zero are set to zero if clip (always needed for unsigned
+    integer outputs)"""
+    for i in range(frame.size):
+        value = frame[i]
+        subtracted = background[i]
+        if clip and value < subtracted:
+            out[i] = 0
+        else:
+            out[i] = value - subtracted
+
+
+class BackgroundManager:
+    """Captures an averaged background (dark) frame and subtracts it from camera frames. The background is kept in the
+    camera's dtype (rounded mean) and as a precomputed float32 copy. subtract works in place (or into out) in one pass
+    and allocates nothing per frame: frames of the background dtype use the native background with clipping at zero,
+    all others the float32 copy. Backgrounds are saved as .npy and loaded into memory (no memory map, so the file can
+    be replaced while loaded, also on Windows); the float32 copy is built whenever a background is set (captured or
+    loaded), so no subtraction pays for it.
+    Capture either all at once with capture(frames) or from a running acquisition with start_capture(n_frames) and
+    add_capture_frame(frame) per frame. Thread safe"""
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._background = None
+        self._background_float32 = None
+        self._capture_sum = None
+        self._capture_n_frames = 0
+        self._capture_count = 0
+        self.path = path
+        if path is not None and os.path.isfile(path):
+            self.load(path)
+
+    @property
+    def has_background(self):
+        return self._background is not None
+
+    @property
+    def is_capturing(self):
+        return self._capture_n_frames > 0
+
+    @property
+    def background(self):
+        """background in the camera dtype (None if none was captured or loaded)"""
+        return self._background
+
+    @property
+    def background_float32(self):
+        """float32 copy of the background (None if none was captured or loaded)"""
+        return self._background_float32
+
+    def _set_background(self, background, background_float32):
+        self._background = background
+        self._background_float32 = background_float32
+
+    def clear(self):
+        """removes the background (and stops a running capture), subtract then leaves frames unchanged"""
+        with self._lock:
+            self._set_background(None, None)
+            self._capture_n_frames = 0
+
+    def start_capture(self, n_frames=10):
+        """starts averaging the next n_frames frames passed to add_capture_frame into a new background"""
+        if n_frames < 1:
+            raise ValueError(f"n_frames has to be at least 1, got {n_frames}")
+        with self._lock:
+            self._capture_n_frames = int(n_frames)
+            self._capture_count = 0
+
+    def add_capture_frame(self, frame):
+        """adds frame to a running capture, returns True when the capture just finished (the new background is set)
+        and False otherwise (also if no capture is running)"""
+        frame = np.asarray(frame)
+        with self._lock:
+            if self._capture_n_frames == 0:
+                return False
+            if self._capture_count == 0:
+                if self._capture_sum is None or self._capture_sum.shape != frame.shape:
+                    self._capture_sum = np.zeros(frame.shape, dtype=np.float64)
+                else:
+                    self._capture_sum.fill(0)
+                self._capture_dtype = frame.dtype
+            elif frame.shape != self._capture_sum.shape:
+                raise ValueError(f"frame shape {frame.shape} differs from the captured shape {self._capture_sum.shape}")
+            np.add(self._capture_sum, frame, out=self._capture_sum)
+            self._capture_count += 1
+            if self._capture_count < self._capture_n_frames:
+                return False
+            mean = self._capture_sum / self._capture_count
+            if np.issubdtype(self._capture_dtype, np.integer):
+                limits = np.iinfo(self._capture_dtype)
+                mean = np.clip(np.rint(mean), limits.min, limits.max)
+            background = mean.astype(self._capture_dtype)
+            self._set_background(background, background.astype(np.float32))
+            self._capture_n_frames = 0
+            return True
+
+    def capture(self, frames):
+        """sets the mean of frames (an iterable of 2D frames or a 3D array) as background"""
+        frames = list(frames) if not isinstance(frames, np.ndarray) else frames
+        self.start_capture(len(frames))
+        for frame in frames:
+            self.add_capture_frame(frame)
+
+    def subtract(self, frame, out=None, clip=True):
+        """subtracts the background from frame in place (or writes to out, e.g. a preallocated float32 array) and
+        returns it. Values below zero are clipped to zero if clip (always for unsigned integer results).
+        Without a background the frame is returned unchanged (copied to out if given)"""
+        if out is None:
+            out = frame
+        elif out.shape != frame.shape:
+            raise ValueError(f"out shape {out.shape} differs from the frame shape {frame.shape}")
+        if not out.flags.c_contiguous:
+            raise ValueError("the frame (or out) has to be C contiguous to be written in place")
+        with self._lock:
+            background = self._background
+            if background is None:
+                if out is not frame:
+                    np.copyto(out, frame, casting="unsafe")
+                return out
+            if frame.shape != background.shape:
+                raise ValueError(f"frame shape {frame.shape} differs from the background shape {background.shape}")
+            if not (frame.dtype == out.dtype == background.dtype):
+                background = self._background_float32
+        clip = clip or np.issubdtype(out.dtype, np.unsignedinteger)
+        _subtract_background(frame.reshape(-1), np.asarray(background).reshape(-1), out.reshape(-1), clip)
+        return out
+
+    def save(self, path=None):
+        """saves the background as .npy to path (default: the path given at creation or last load). The file is
+        written under a temporary name and then replaced atomically, so a reader never sees a half written file"""
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("no path given")
+        if self._background is None:
+            raise ValueError("no background to save")
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            np.save(file, np.asarray(self._background))
+        os.replace(temporary_path, path)
+        self.path = path
+
+    def load(self, path=None):
+        """loads a background saved with save into memory and builds its float32 copy. The file is closed again, so
+        save can replace it"""
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("no path given")
+        background = np.load(path)
+        if background.ndim != 2:
+            raise ValueError(f"background in {path} has to be 2D, got shape {background.shape}")
+        background_float32 = np.array(background, dtype=np.float32)  # outside the lock, subtract does not wait for it
+        with self._lock:
+            self._set_background(background, background_float32)
+        self.path = path
+
+    def reload(self):
+        """loads the background file again (e.g. after it was replaced by another program)"""
+        self.load()
+
+
+# ----- saturation (over power) detection -----
+@njit(cache=True)
+def _count_above(frame, saturation_level, warning_level):
+    """returns (number of pixels >= saturation_level, number of pixels >= warning_level) in one (vectorized) pass"""
+    n_saturated = 0
+    n_warning = 0
+    for i in range(frame.size):
+        value = frame[i]
+        n_saturated += value >= saturation_level
+        n_warning += value >= warning_level
+    return n_saturated, n_warning
+
+
+class SaturationDetector:
+    """Checks camera frames for saturation. The peak is one SIMD max reduction (numpy's max is several times faster than
+    a numba loop with a max, about 0.07 ms per uint16 megapixel) and only frames with a peak at or above the warning
+    level get a second (fused numba) pass counting warning and saturated pixels, so even those stay below 0.6 ms per
+    megapixel. full_scale is the
+    largest camera value (default: the maximum of the integer dtype of the first frame, give it for e.g. 12 bit
+    cameras in uint16 frames or float frames), pixels at or above saturation_fraction * full_scale count as saturated.
+    check(frame) returns and publishes a dict with "peak", "fraction" (peak / full_scale), "n_saturated",
+    "saturated_fraction" (of all pixels), "n_warning" (pixels at or above warning_fraction * full_scale) and "state":
+    "saturated" if at least saturated_pixels_limit pixels are saturated, "warning" if the peak is at or above
+    warning_fraction of full scale, otherwise "ok". The GUI reads the last result thread safe from the create_data_lock
+    result (e.g. to color a button red or yellow). n_frames, n_warning_frames and n_saturated_frames count the
+    checked frames since the last reset"""
+
+    def __init__(self, full_scale=None, saturation_fraction=1.0, warning_fraction=0.8, saturated_pixels_limit=1):
+        self.full_scale = full_scale
+        self.saturation_fraction = saturation_fraction
+        self.warning_fraction = warning_fraction
+        self.saturated_pixels_limit = saturated_pixels_limit
+        self.result = create_data_lock(None)
+        self.reset()
+
+    def reset(self):
+        """resets the frame counters and the published result"""
+        self.n_frames = 0
+        self.n_warning_frames = 0
+        self.n_saturated_frames = 0
+        self.result.set(None)
+
+    def check(self, frame):
+        """checks a frame (any real dtype), publishes the result in self.result and returns it"""
+        frame = np.asarray(frame)
+        full_scale = self.full_scale
+        if full_scale is None:
+            if not np.issubdtype(frame.dtype, np.integer):
+                raise ValueError(f"full_scale has to be given for {frame.dtype} frames")
+            full_scale = np.iinfo(frame.dtype).max
+        saturation_level = self.saturation_fraction * full_scale
+        warning_level = self.warning_fraction * full_scale
+        if np.issubdtype(frame.dtype, np.integer):  # compare in the frame dtype (no conversion per pixel)
+            saturation_level = min(int(np.ceil(saturation_level)), np.iinfo(frame.dtype).max)
+            warning_level = min(int(np.ceil(warning_level)), np.iinfo(frame.dtype).max)
+        peak = frame.max()
+        if peak >= warning_level:
+            n_saturated, n_warning = _count_above(
+                frame.reshape(-1), frame.dtype.type(saturation_level), frame.dtype.type(warning_level)
+            )
+        else:
+            n_saturated = n_warning = 0
+        if n_saturated >= self.saturated_pixels_limit:
+            state = "saturated"
+        elif n_warning > 0:
+            state = "warning"
+        else:
+            state = "ok"
+        result = {
+            "state": state,
+            "peak": peak.item(),
+            "fraction": float(peak) / full_scale,
+            "n_saturated": int(n_saturated),
+            "saturated_fraction": n_saturated / frame.size,
+            "n_warning": int(n_warning),
+        }
+        self.n_frames += 1
+        self.n_warning_frames += state == "warning"
+        self.n_saturated_frames += state == "saturated"
+        self.result.set(result, deepcopy=False)
+        return result